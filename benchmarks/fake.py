@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""In-memory stand-in for the parts of MongoClient used by monsch.
+
+Documents are stored BSON encoded so reads and writes pay the encoding
+costs of a real driver, without any network or server time.
+"""
+
+import bson
+import copy
+
+
+def _encode(doc):
+    return bson.BSON.encode(doc)
+
+
+def _decode(data):
+    return bson.BSON(data).decode()
+
+
+def _matches(doc, spec):
+    for key, value in (spec or {}).iteritems():
+        if isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+            for op, arg in value.iteritems():
+                if op == '$in' and doc.get(key) not in arg:
+                    return False
+                if op == '$gt' and not doc.get(key) > arg:
+                    return False
+                if op == '$lt' and not doc.get(key) < arg:
+                    return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def _apply(doc, update):
+    for op, paths in update.iteritems():
+        for path, arg in paths.iteritems():
+            parts = path.split('.')
+            parent = doc
+            for part in parts[:-1]:
+                parent = parent.setdefault(part, {})
+            key = parts[-1]
+            if op == '$set':
+                parent[key] = copy.deepcopy(arg)
+            elif op == '$unset':
+                parent.pop(key, None)
+            elif op == '$inc':
+                parent[key] = parent.get(key, 0) + arg
+            elif op == '$push':
+                parent.setdefault(key, []).extend(arg['$each'])
+            elif op == '$addToSet':
+                values = parent.setdefault(key, [])
+                values.extend(v for v in arg['$each'] if v not in values)
+            elif op == '$pullAll':
+                parent[key] = [v for v in parent.get(key, []) if v not in arg]
+            else:
+                raise NotImplementedError(op)
+
+
+class FakeCursor(object):
+
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __iter__(self):
+        return iter(self._docs)
+
+    def next(self):
+        if not self._docs:
+            raise StopIteration
+        return self._docs.pop(0)
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, basestring) else key
+        for field, direction in reversed(keys):
+            self._docs.sort(key=lambda d: d.get(field), reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        if limit:
+            self._docs = self._docs[:limit]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        self._docs = []
+
+
+class FakeBulk(object):
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._ops = []
+        self._spec = None
+        self._upsert = False
+
+    def find(self, spec):
+        self._spec, self._upsert = spec, False
+        return self
+
+    def upsert(self):
+        self._upsert = True
+        return self
+
+    def replace_one(self, doc):
+        self._ops.append(lambda: self._collection.save(doc))
+
+    def update_one(self, update):
+        spec = self._spec
+        self._ops.append(lambda: self._collection.update(spec, update))
+
+    def insert(self, doc):
+        self._ops.append(lambda: self._collection.insert(doc))
+
+    def execute(self, **kwargs):
+        for op in self._ops:
+            op()
+        self._ops = []
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self._docs = {}
+        self._indexes = {'_id_': {'key': [('_id', 1)]}}
+
+    def _find(self, spec):
+        if spec and set(spec) == set(['_id']) and not isinstance(spec['_id'], dict):
+            data = self._docs.get(spec['_id'])
+            return [] if data is None else [_decode(data)]
+        docs = (_decode(data) for data in self._docs.itervalues())
+        return [doc for doc in docs if _matches(doc, spec)]
+
+    def find(self, spec=None, projection=None, **kwargs):
+        return FakeCursor(self._find(spec))
+
+    def find_one(self, spec=None, projection=None, sort=None, **kwargs):
+        cursor = self.find(spec)
+        if sort:
+            cursor.sort(sort)
+        docs = list(cursor)
+        return docs[0] if docs else None
+
+    def insert(self, doc, **kwargs):
+        if '_id' not in doc:
+            doc['_id'] = bson.ObjectId()
+        self._docs[doc['_id']] = _encode(doc)
+        return doc['_id']
+
+    save = insert
+
+    def update(self, spec, update, **kwargs):
+        for doc in self._find(spec)[:1]:
+            _apply(doc, update)
+            self._docs[doc['_id']] = _encode(doc)
+
+    def remove(self, spec=None, **kwargs):
+        for doc in self._find(spec):
+            del self._docs[doc['_id']]
+
+    def drop(self):
+        self._docs.clear()
+
+    def with_options(self, **kwargs):
+        return self
+
+    def initialize_unordered_bulk_op(self):
+        return FakeBulk(self)
+
+    initialize_ordered_bulk_op = initialize_unordered_bulk_op
+
+    def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+    def create_index(self, keys, **kwargs):
+        name = '_'.join('%s_%s' % key for key in keys)
+        self._indexes[name] = {'key': list(keys)}
+        return name
+
+
+class FakeDatabase(object):
+
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = FakeCollection()
+        return collection
+
+
+class FakeClient(object):
+
+    def __init__(self, host=None, **kwargs):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = FakeDatabase()
+        return database
+
+    def close(self):
+        pass
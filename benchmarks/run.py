@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of schema validation and Document operations.
+
+Run `python -m benchmarks` from the repository root. Documents are kept
+by an in-memory stand-in of MongoClient. Each benchmark reports its
+calls per second and the objects tracked by the garbage collector that
+every call leaves alive. Runs are compared to the committed
+baseline.json and fail when a benchmark got slower than the tolerance
+or retains more objects. Timings depend on the machine, `--save` on the
+base revision stores a baseline to compare a change against.
+"""
+
+import argparse
+import bson
+import datetime
+import gc
+import json
+import os
+import re
+import sys
+import timeit
+
+import monsch.monsch
+from monsch import Pools, Document, Schema, Or, And, Optional, Use, Default, SchemaError
+from .fake import FakeClient
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+benchmarks = []
+
+
+def benchmark(name):
+    def register(setup):
+        benchmarks.append((name, setup))
+        return setup
+    return register
+
+
+test_doc_structure = {
+    Optional('_id'): bson.ObjectId,
+    'name': Use(str),
+    'price': Use(float),
+    'version': And(Use(str),
+                   lambda v: re.compile(r'^v\d+\.\d+\.\d+$').match(v)),
+    'ctime': Or(datetime.datetime,
+                default=Default(datetime.datetime.now)),
+    Optional('desc'): Use(str),
+    'status': Or(And(Use(int),
+                     Or(0, 1, 2)),
+                 default=1),
+    'groups': Or([Use(str)], default=['user']),
+    'confs': {
+        'type': Or('a', 'b', 'c'),
+    },
+    'counts': Or({'total': And(Use(int),
+                               lambda v: v >= 0)},
+                 default={'total': 0})
+}
+
+
+def test_doc_data(i=0):
+    return {
+        'name': 'bench%d' % i,
+        'price': i,
+        'version': 'v0.0.1',
+        'confs': {
+            'type': 'a',
+        },
+        'desc': 'benchmark',
+    }
+
+
+class BenchDoc(Document):
+    __collection__ = 'bench'
+    structure = test_doc_structure
+
+
+def _nested(depth):
+    return {'value': int} if depth == 0 else {'value': int, 'child': _nested(depth - 1)}
+
+
+def _nested_data(depth):
+    return {'value': depth} if depth == 0 else {'value': depth, 'child': _nested_data(depth - 1)}
+
+
+@benchmark('schema.flat')
+def schema_flat():
+    validate = Schema(dict(('f%d' % i, int) for i in xrange(40))).validate
+    data = dict(('f%d' % i, i) for i in xrange(40))
+    return lambda: validate(data)
+
+
+@benchmark('schema.deep')
+def schema_deep():
+    validate = Schema(_nested(10)).validate
+    data = _nested_data(10)
+    return lambda: validate(data)
+
+
+@benchmark('schema.wide')
+def schema_wide():
+    validate = Schema({Optional('id'): int, basestring: Or(int, basestring)}).validate
+    data = dict(('k%d' % i, i if i % 2 else str(i)) for i in xrange(200))
+    return lambda: validate(data)
+
+
+@benchmark('schema.lists')
+def schema_lists():
+    validate = Schema([{'name': basestring, 'tags': [Use(str)], 'scores': [int, float]}]).validate
+    data = [{'name': 'n%d' % i, 'tags': ['a', 'b', 'c'], 'scores': [1, 2.5, 3]}
+            for i in xrange(50)]
+    return lambda: validate(data)
+
+
+@benchmark('schema.test_doc')
+def schema_test_doc():
+    validate = Schema(test_doc_structure).validate
+    data = test_doc_data()
+    return lambda: validate(data)
+
+
+@benchmark('schema.test_doc_invalid')
+def schema_test_doc_invalid():
+    validate = Schema(test_doc_structure).validate
+    data = dict(test_doc_data(), confs={'type': 'z'}, extra=range(100))
+
+    def run():
+        try:
+            validate(data)
+        except SchemaError:
+            pass
+    return run
+
+
+@benchmark('document.create')
+def document_create():
+    data = test_doc_data()
+    return lambda: BenchDoc(data)
+
+
+@benchmark('document.insert')
+def document_insert():
+    data = test_doc_data()
+    return lambda: BenchDoc(data).save()
+
+
+@benchmark('document.refresh')
+def document_refresh():
+    _id = BenchDoc(test_doc_data()).save()
+    return lambda: BenchDoc(_id)
+
+
+@benchmark('document.commit')
+def document_commit():
+    doc = BenchDoc(BenchDoc(test_doc_data()).save())
+
+    def run():
+        doc.inc('counts.total')
+        doc['desc'] = 'changed'
+        doc.commit()
+    return run
+
+
+@benchmark('document.save')
+def document_save():
+    doc = BenchDoc(BenchDoc(test_doc_data()).save())
+    prices = iter(xrange(sys.maxint))
+
+    def run():
+        doc['price'] = next(prices)
+        doc.save()
+    return run
+
+
+@benchmark('document.bulk_save')
+def document_bulk_save():
+    data = [test_doc_data(i) for i in xrange(100)]
+    return lambda: BenchDoc.bulk_save(BenchDoc(d) for d in data)
+
+
+@benchmark('pools.get_connection')
+def pools_get_connection():
+    return lambda: Pools.get_connection('bench')
+
+
+@benchmark('pools.get_collection')
+def pools_get_collection():
+    return lambda: BenchDoc.get_collection()
+
+
+def measure(run, min_time=0.2, repeat=3):
+    """Return the best ops/sec of `repeat` rounds of at least `min_time`."""
+    timer = timeit.Timer(run)
+    number = 1
+    while timer.timeit(number) < min_time / 10:
+        number *= 10
+    best = min(timer.repeat(repeat, number))
+    return number / best
+
+
+def retained(run, number=100):
+    """Return the gc tracked objects `number` calls left alive per call."""
+    gc.collect()
+    before = len(gc.get_objects())
+    for _ in xrange(number):
+        run()
+    gc.collect()
+    return float(len(gc.get_objects()) - before) / number
+
+
+def setup_pools():
+    monsch.monsch.MongoClient = FakeClient
+    Pools.set_confs('bench', {'host': 'localhost', 'port': 27017, 'db': 'bench'})
+    Pools.set_default_name('bench')
+
+
+def run(selected=None):
+    setup_pools()
+    results = {}
+    for name, setup in benchmarks:
+        if selected and not any(s in name for s in selected):
+            continue
+        BenchDoc.get_collection().drop()
+        func = setup()
+        gc.collect()
+        # measured after the timing rounds warmed caches up
+        ops = measure(func)
+        results[name] = {'ops': ops, 'retained': retained(func)}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*', help="run the benchmarks containing one of these")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help="store the results as baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="slowdown to the baseline counted as a regression")
+    parser.add_argument('--retained-tolerance', type=float, default=1.0,
+                        help="objects retained per call over the baseline counted as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.names)
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print '%-28s %14s %12s %8s %12s' % ('benchmark', 'ops/sec', 'retained/op', 'ratio',
+                                         'baseline')
+    for name in sorted(results):
+        result = results[name]
+        ratio = base_retained = ''
+        if name in baseline:
+            ratio = result['ops'] / baseline[name]['ops']
+            base_retained = baseline[name]['retained']
+            if (ratio < 1 - args.tolerance
+                    or result['retained'] > base_retained + args.retained_tolerance):
+                regressions.append(name)
+            ratio = '%.2f' % ratio
+            base_retained = '%.1f' % base_retained
+        print '%-28s %14.1f %12.1f %8s %12s' % (name, result['ops'], result['retained'],
+                                                ratio, base_retained)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print 'baseline saved to %s' % args.baseline
+    if regressions:
+        print 'regressions: %s' % ', '.join(regressions)
+        return 1
+    return 0
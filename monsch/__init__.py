@@ -2,8 +2,13 @@
 
 __all__ = ('Schema', 'SchemaError',
            'Or', 'And', 'Optional', 'Use', 'Default',
-           'Pools', 'Document')
+           'Pools', 'Document', 'DocumentCursor', 'DocumentCache',
+           'WriteBehindBuffer', 'CollectionScanWarning',
+           'Collector', 'HistogramCollector', 'set_collector')
 
 
 from .schema import *
+from .cache import *
+from .buffer import *
+from .instrument import *
 from .monsch import *
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from .monsch import Document, Pools
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # python 2 without the `futures` package
+    ThreadPoolExecutor = None
+
+
+__all__ = ('AsyncPools', 'AsyncDocument')
+
+
+class AsyncPools(object):
+    """Registry of the executors running the calls of each connection.
+
+    A thread pool of `max_workers` threads is created on first use, any
+    object with an executor `submit` method, such as an adapter for an
+    async driver, can be registered instead with `set_executor`.
+    """
+
+    max_workers = 8
+
+    _executors = {}
+    _pid = os.getpid()
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_executor(cls, name=None):
+        name = Pools.get_default_name(name)
+        cls._check_pid()
+        executor = cls._executors.get(name)
+        if executor is None:
+            with cls._lock:
+                executor = cls._executors.get(name)
+                if executor is None:
+                    if ThreadPoolExecutor is None:
+                        raise RuntimeError("AsyncDocument requires the `futures` package on python 2.")
+                    executor = cls._executors[name] = ThreadPoolExecutor(cls.max_workers)
+        return executor
+
+    @classmethod
+    def set_executor(cls, name, executor):
+        with cls._lock:
+            cls.shutdown(name)
+            cls._executors[name] = executor
+
+    @classmethod
+    def shutdown(cls, name=None, wait=True):
+        with cls._lock:
+            executor = cls._executors.pop(Pools.get_default_name(name), None)
+        if executor is not None and hasattr(executor, 'shutdown'):
+            executor.shutdown(wait)
+
+    @classmethod
+    def _check_pid(cls):
+        # executor threads don't survive a fork
+        if cls._pid != os.getpid():
+            cls._lock = threading.RLock()
+            cls._executors = {}
+            cls._pid = os.getpid()
+
+
+class AsyncDocument(Document):
+    """Document whose database calls run in an executor.
+
+    They return `concurrent.futures.Future` objects, asyncio code awaits
+    them with `asyncio.wrap_future`. Creating one from an `_id` doesn't
+    fetch it, call `load`. A document must not be modified while one of
+    its writes is pending.
+    """
+
+    __abstract__ = True
+
+    def _load_initial(self, trusted=None, fields=None):
+        self._load_cached()
+
+    @classmethod
+    def _submit(cls, fn, *args, **kwargs):
+        return AsyncPools.get_executor(cls.__pool__).submit(fn, *args, **kwargs)
+
+    def load(self, trusted=None, fields=None):
+        """Fetch the document, the future resolves to the document."""
+        def load():
+            Document.refresh(self, trusted=trusted, fields=fields)
+            return self
+        return self._submit(load)
+
+    def refresh(self, trusted=None, fields=None):
+        return self.load(trusted=trusted, fields=fields)
+
+    def save(self, replace=True, refresh=False, *args, **kwargs):
+        def save():
+            _id = Document.save(self, replace, False, *args, **kwargs)
+            if refresh:
+                Document.refresh(self)
+            return _id
+        return self._submit(save)
+
+    def commit(self, refresh=False, *args, **kwargs):
+        if self._buffer is not None and self._in_db and not refresh:
+            # into the write-behind buffer, like Document.commit
+            return self._submit(Document.commit, self)
+        return self.save(False, refresh, *args, **kwargs)
+
+    def remove(self, *args, **kwargs):
+        return self._submit(Document.remove, self, *args, **kwargs)
+
+    @classmethod
+    def find(cls, *args, **kwargs):
+        """Return a future of the list of documents `Document.find` yields."""
+        return cls._submit(lambda: list(super(AsyncDocument, cls).find(*args, **kwargs)))
+
+    @classmethod
+    def find_one(cls, *args, **kwargs):
+        return cls._submit(super(AsyncDocument, cls).find_one, *args, **kwargs)
+
+    @classmethod
+    def get_many(cls, *args, **kwargs):
+        return cls._submit(super(AsyncDocument, cls).get_many, *args, **kwargs)
+
+    @classmethod
+    def bulk_save(cls, *args, **kwargs):
+        return cls._submit(super(AsyncDocument, cls).bulk_save, *args, **kwargs)
+
+    @classmethod
+    def export(cls, *args, **kwargs):
+        return cls._submit(super(AsyncDocument, cls).export, *args, **kwargs)
+
+    @classmethod
+    def import_(cls, *args, **kwargs):
+        return cls._submit(super(AsyncDocument, cls).import_, *args, **kwargs)
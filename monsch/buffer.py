@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import copy
+import operator
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def _merge_each(pending, arg):
+    return {'$each': pending['$each'] + arg['$each']}
+
+
+# operators whose repeated updates of a path fold into one
+_mergers = {
+    '$inc': operator.add,
+    '$pullAll': operator.add,
+    '$push': _merge_each,
+    '$addToSet': _merge_each,
+}
+
+
+def _merge(pending, update):
+    """Merge `update` into the `pending` one, False when they conflict.
+
+    `$set` and `$unset` override what is pending at or below their path.
+    """
+    overridden = []
+    for op, paths in update.iteritems():
+        for path in paths:
+            for pending_op, pending_paths in pending.iteritems():
+                for pending_path in pending_paths:
+                    if path.startswith(pending_path + '.'):
+                        return False
+                    if pending_path == path or pending_path.startswith(path + '.'):
+                        if op in ('$set', '$unset'):
+                            overridden.append((pending_op, pending_path))
+                        elif pending_path != path or pending_op != op or op not in _mergers:
+                            return False
+
+    for op, path in overridden:
+        pending[op].pop(path, None)
+    for op, paths in update.iteritems():
+        target = pending.setdefault(op, {})
+        for path, arg in paths.iteritems():
+            target[path] = _mergers[op](target[path], arg) if path in target else arg
+    for op in [op for op, paths in pending.iteritems() if not paths]:
+        del pending[op]
+    return True
+
+
+class WriteBehindBuffer(object):
+    """Coalesce the commits of `document_class` and write them in bulk.
+
+    Updates of the same `_id` are merged into one. A commit only reaches
+    the database when the buffer is flushed: `max_delay` seconds after the
+    oldest pending commit, as soon as `max_size` documents are pending, on
+    `flush()` and on `close()`, which also runs at interpreter exit.
+    Pending commits are lost if the process dies before. `refresh()`,
+    `save()`, `remove()`, `bulk_save()` and `get_many()` flush first,
+    queries such as `find()`, `find_one()` and `paginate()` don't see
+    pending commits until the buffer is flushed. Past
+    `max_pending` queued updates, committing flushes in the caller's
+    thread. A failed flush calls `on_error(error, updates)` with the
+    `(_id, update)` pairs that may not have been written. Without it the
+    error is raised by `flush()`, or by the next `flush()` or `close()`
+    for a background flush.
+    """
+
+    def __init__(self, document_class, max_size=1000, max_delay=1.0,
+                 max_pending=10000, on_error=None):
+        self.document_class = document_class
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self._pending = OrderedDict()
+        self._count = 0
+        self._oldest = None
+        self._error = None
+        self._closed = False
+        self._thread = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, _id):
+        return _id in self._pending
+
+    def add(self, _id, update):
+        if self._closed:
+            raise RuntimeError("Write-behind buffer is closed.")
+        self._check_pid()
+        update = copy.deepcopy(update)
+        with self._lock:
+            updates = self._pending.get(_id)
+            if updates is None:
+                self._pending[_id] = [update]
+                self._count += 1
+            elif not _merge(updates[-1], update):
+                # written after the pending one
+                updates.append(update)
+                self._count += 1
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = len(self._pending) >= self.max_size
+            blocked = self._count >= self.max_pending
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        if blocked:
+            self._flush()
+        elif full:
+            self._wake.set()
+
+    def flush(self, _id=None):
+        """Write the pending updates, only the ones of `_id` if given."""
+        self._flush(_id)
+        if _id is None and self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _check_pid(self):
+        # updates and thread inherited from the parent process belong to it
+        if self._pid != os.getpid():
+            self._pending = OrderedDict()
+            self._count = 0
+            self._oldest = None
+            self._thread = None
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._flush_lock = threading.Lock()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            with self._lock:
+                due = self._pending and (len(self._pending) >= self.max_size
+                                         or time.time() - self._oldest >= self.max_delay)
+            if due:
+                try:
+                    self._flush()
+                except Exception as x:
+                    self._error = x
+
+    def _flush(self, _id=None):
+        with self._flush_lock:
+            with self._lock:
+                if _id is None:
+                    pending = self._pending
+                    self._pending = OrderedDict()
+                elif _id in self._pending:
+                    pending = {_id: self._pending.pop(_id)}
+                else:
+                    return
+                self._count -= sum(len(updates) for updates in pending.itervalues())
+                if not self._pending:
+                    self._oldest = None
+            if pending:
+                self._write(pending)
+
+    def _write(self, pending):
+        collection = self.document_class.get_collection()
+        # the n-th updates of every document are written by the n-th bulk
+        rounds = max(len(updates) for updates in pending.itervalues())
+        for i in xrange(rounds):
+            batch = [(_id, updates[i]) for _id, updates in pending.iteritems()
+                     if i < len(updates)]
+            bulk = collection.initialize_unordered_bulk_op()
+            for _id, update in batch:
+                bulk.find({'_id': _id}).update_one(update)
+            try:
+                bulk.execute()
+            except Exception as x:
+                if self.on_error is None:
+                    raise
+                failed = batch + [(_id, update) for _id, updates in pending.iteritems()
+                                  for update in updates[i + 1:]]
+                self.on_error(x, failed)
+                return
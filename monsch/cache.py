@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class DocumentCache(object):
+    """Bounded LRU cache of loaded documents with an optional TTL.
+
+    Hit, miss, eviction and expiration counters help sizing it.
+    """
+
+    def __init__(self, size=1024, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                self.expirations += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
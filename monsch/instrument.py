@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import bson
+import math
+import threading
+from timeit import default_timer
+
+
+__all__ = ('Collector', 'HistogramCollector', 'set_collector')
+
+
+# the registered collector, None when nothing is measured
+collector = None
+
+
+def set_collector(new):
+    """Register the collector receiving the measurements of every Document.
+
+    `new` is a Collector, a callable taking `(kind, name, value, tags)`,
+    or None to stop measuring. Returns the previous collector.
+    """
+    global collector
+    if new is not None and not isinstance(new, Collector):
+        new = _CallbackCollector(new)
+    old, collector = collector, new
+    return old
+
+
+class Collector(object):
+    """Receiver of measurements, subclasses forward them to StatsD & co.
+
+    Names are `validate`, `validate_partial`, `validate_id`, `field` and
+    `db` for timings, `db.sent` and `db.received` for payload sizes in
+    bytes. `tags` holds the `document` class name and, depending on the
+    measurement, the `field` name or the collection method as `op`.
+    """
+
+    def timing(self, name, seconds, tags):
+        pass
+
+    def size(self, name, size, tags):
+        pass
+
+
+class _CallbackCollector(Collector):
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def timing(self, name, seconds, tags):
+        self.callback('timing', name, seconds, tags)
+
+    def size(self, name, size, tags):
+        self.callback('size', name, size, tags)
+
+
+class HistogramCollector(Collector):
+    """Keep the count, sum, min, max and power of two buckets in process."""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def timing(self, name, seconds, tags):
+        self._add(name, seconds, tags)
+
+    def size(self, name, size, tags):
+        self._add(name, size, tags)
+
+    def _add(self, name, value, tags):
+        key = (name,) + tuple(sorted(tags.iteritems()))
+        bucket = math.frexp(value)[1] if value > 0 else None
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'count': 0, 'sum': 0, 'min': value, 'max': value, 'buckets': {}}
+            series['count'] += 1
+            series['sum'] += value
+            series['min'] = min(series['min'], value)
+            series['max'] = max(series['max'], value)
+            # values up to 2 ** bucket
+            series['buckets'][bucket] = series['buckets'].get(bucket, 0) + 1
+
+    def stats(self):
+        """Return the series by `(name, (tag, value)...)` keys."""
+        with self._lock:
+            return dict((key, dict(series, buckets=dict(series['buckets'])))
+                        for key, series in self._series.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+
+def timed(name, tags, validate, value):
+    start = default_timer()
+    try:
+        return validate(value)
+    finally:
+        current = collector
+        if current is not None:
+            current.timing(name, default_timer() - start, tags)
+
+
+def timed_field(document, key, validate):
+    """Wrap the validator of the field `key` to measure it."""
+    tags = {'document': document, 'field': getattr(key, '_schema', key)}
+
+    def validate_field(value):
+        return timed('field', tags, validate, value)
+    return validate_field
+
+
+def db_call(document, op, method, args, kwargs, payload=None):
+    """Measure the collection call `method(*args, **kwargs)`."""
+    current = collector
+    if current is None:
+        # unregistered since the caller checked
+        return method(*args, **kwargs)
+    tags = {'document': document, 'op': op}
+    if payload is not None:
+        current.size('db.sent', _bson_size(payload), tags)
+    start = default_timer()
+    result = method(*args, **kwargs)
+    current.timing('db', default_timer() - start, tags)
+    if hasattr(result, 'keys'):
+        current.size('db.received', _bson_size(result), tags)
+    return result
+
+
+def _bson_size(doc):
+    raw = getattr(doc, 'raw', None)
+    if raw is not None:
+        return len(raw)
+    try:
+        return len(bson.BSON.encode(doc))
+    except Exception:
+        return 0
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import bson
+import datetime
+from .schema import Strategy, Schema, Or, And, Optional, priority
+
+
+# bson types of the values stored for an instance check, as loaded back
+_bson_types = {
+    basestring: 'string',
+    # ints above 32 bits are stored as int64
+    int: ['int', 'long', 'bool'],
+    long: 'long',
+    float: 'double',
+    bool: 'bool',
+    dict: 'object',
+    list: 'array',
+    datetime.datetime: 'date',
+    bson.ObjectId: 'objectId',
+    type(None): 'null',
+}
+
+_literal_types = (basestring, int, long, float, bool, type(None))
+
+
+def to_json_schema(structure):
+    """Translate a Document `structure` into a `$jsonSchema` document.
+
+    Returns the schema, the set of top-level fields it enforces exactly
+    and the `(path, repr)` pairs of the nodes it can't express. The
+    schema never rejects a value the structure accepts, untranslated
+    nodes are only checked by the client.
+    """
+    untranslated = []
+    schema, _, covered = _translate_dict(structure, '', untranslated, top=True)
+    return schema, covered, untranslated
+
+
+def _translate(s, path, untranslated):
+    """Return the schema of the values `s` produces and whether it is exact.
+
+    The schema is None when `s` may convert the value.
+    """
+    if type(s) is list:
+        items, exact = _translate_or(s, path + '[]', untranslated)
+        schema = {'bsonType': 'array'}
+        if items:
+            schema['items'] = items
+        return schema, exact
+
+    if type(s) is dict:
+        schema, exact, _ = _translate_dict(s, path, untranslated)
+        return schema, exact
+
+    if type(s) is Or:
+        return _translate_or(s._args, path, untranslated)
+    if type(s) is And:
+        return _translate_and(s._args, path, untranslated)
+    if type(s) in (Schema, Optional):
+        return _translate(s._schema, path, untranslated)
+
+    if s is object:
+        return {}, True
+
+    if issubclass(type(s), type) and s in _bson_types:
+        return {'bsonType': _bson_types[s]}, True
+
+    if priority(s) == 1 and isinstance(s, _literal_types):
+        return {'enum': [s]}, True
+
+    untranslated.append((path, repr(s)))
+    if isinstance(s, Strategy):
+        return None, False
+    # a callable or an instance check only lets values through unchanged
+    return {}, False
+
+
+def _translate_or(args, path, untranslated):
+    schemas, exact = [], True
+    for a in args:
+        schema, a_exact = _translate(a, path, untranslated)
+        exact = exact and a_exact
+        schemas.append(schema)
+    if None in schemas:
+        return None, False
+    if {} in schemas:
+        return {}, exact
+    if all(schema.keys() == ['enum'] for schema in schemas):
+        enum = []
+        for schema in schemas:
+            enum.extend(v for v in schema['enum']
+                        if not any(type(v) is type(e) and v == e for e in enum))
+        return {'enum': enum}, exact
+    if len(schemas) == 1:
+        return schemas[0], exact
+    return {'anyOf': schemas}, exact
+
+
+def _translate_and(args, path, untranslated):
+    schemas, exact = [], True
+    for a in args:
+        schema, a_exact = _translate(a, path, untranslated)
+        exact = exact and a_exact
+        if schema is None:
+            # the checks before a conversion don't apply to the stored value
+            schemas = []
+        elif schema:
+            schemas.append(schema)
+    if not schemas:
+        return {}, exact
+    if len(schemas) == 1:
+        return schemas[0], exact
+    return {'allOf': schemas}, exact
+
+
+def _translate_dict(s, path, untranslated, top=False):
+    schema = {'bsonType': 'object'}
+    properties = {}
+    required = []
+    exact = True
+    covered = set()
+    additional = False
+    for skey, value in s.iteritems():
+        optional = type(skey) is Optional
+        key = skey._schema if optional else skey
+        key_path = path + '.' + key if path and isinstance(key, basestring) else key
+
+        if not isinstance(key, basestring):
+            # a pattern key, the values of the other keys match it
+            key_path = '%s.<%r>' % (path, key) if path else '<%r>' % key
+            if key is basestring and optional and additional is False:
+                additional, field_exact = _translate(value, key_path, untranslated)
+                additional = {} if additional is None else additional
+            else:
+                untranslated.append((key_path, repr(skey)))
+                additional, field_exact = True, False
+            exact = exact and field_exact
+            continue
+
+        field, field_exact = _translate(value, key_path, untranslated)
+        properties[key] = {} if field is None else field
+        if not optional:
+            required.append(key)
+            if not top and hasattr(value, 'default'):
+                # filling in the default is left to the client
+                field_exact = False
+        if field_exact:
+            covered.add(key)
+        exact = exact and field_exact
+
+    if properties:
+        schema['properties'] = properties
+    if required:
+        schema['required'] = sorted(required)
+    if additional is not True:
+        schema['additionalProperties'] = additional
+    return schema, exact, covered
@@ -1,21 +1,75 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import bson
+import importlib
+import multiprocessing
+import operator
+import os
 import re
-from .schema import Schema, Or, And, Optional, Default
+import struct
+import threading
+import warnings
+from collections import deque
+from itertools import chain, islice
+from . import instrument
+from .buffer import WriteBehindBuffer, _merge_each
+from .cache import DocumentCache
+from .json_schema import to_json_schema
+from .schema import Schema, SchemaError, Or, And, Optional, Default
 from pymongo import MongoClient
+from bson import json_util
+from pymongo.errors import OperationFailure
+
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:  # pymongo < 3.2
+    RawBSONDocument = None
+
+
+class CollectionScanWarning(UserWarning):
+    """A query of a Document is planned as a collection scan."""
 
 
 class Pools(object):
+    """Registry of named connection configurations and their clients.
+
+    Each client is created once, on first use, and shared by every thread.
+    A process forked after clients were created builds its own ones.
+    """
 
     _default_name = None
     _pool_confs = {}
     _pools = {}
+    _pid = os.getpid()
+    _lock = threading.RLock()
+    # bumped whenever a database handle obtained before may have gone stale
+    _generation = 0
+
+    # configuration keys making up the mongodb uri, the other ones are
+    # passed to MongoClient as options
+    _uri_keys = ('host', 'port', 'db', 'username', 'password')
 
     @classmethod
     def get_connection(cls, name=None):
         name = cls.get_default_name(name)
-        return cls._pools.setdefault(name, cls.connect(name))
+        cls._check_pid()
+        connection = cls._pools.get(name)
+        if connection is None:
+            with cls._lock:
+                connection = cls._pools.get(name)
+                if connection is None:
+                    connection = cls._pools[name] = cls.connect(name)
+        return connection
+
+    @classmethod
+    def _check_pid(cls):
+        # clients inherited from the parent process must not be used
+        if cls._pid != os.getpid():
+            cls._lock = threading.RLock()
+            cls._pools = {}
+            cls._pid = os.getpid()
+            cls._generation += 1
 
     @classmethod
     def connect(cls, name):
@@ -30,24 +84,19 @@ class Pools(object):
             uri = 'mongodb://%s:%s/%s' % (confs['host'],
                                           confs['port'],
                                           confs['db'])
-        kwargs = {}
-        for kw in ('max_pool_size',
-                   'connectTimeoutMS',
-                   'socketTimeoutMS',
-                   'waitQueueTimeoutMS',
-                   'waitQueueMultiple'):
-            if kw in confs:
-                kwargs[kw] = confs[kw]
+        kwargs = {key: value for key, value in confs.iteritems()
+                  if key not in cls._uri_keys}
 
         return MongoClient(host=uri, **kwargs)
 
     @classmethod
     def disconnect(cls, name):
-        if name not in cls._pools:
-            return
-        connection = cls._pools[name]
-        del cls._pools[name]
-        connection.disconnect()
+        cls._check_pid()
+        with cls._lock:
+            connection = cls._pools.pop(name, None)
+            cls._generation += 1
+        if connection is not None:
+            connection.close()
 
     @classmethod
     def get_database(cls, name=None):
@@ -69,7 +118,9 @@ class Pools(object):
     @classmethod
     def set_default_name(cls, name):
         if name in cls._pool_confs:
-            cls._default_name = name
+            with cls._lock:
+                cls._default_name = name
+                cls._generation += 1
         else:
             raise KeyError(name)
         return name
@@ -82,19 +133,168 @@ class Pools(object):
 
     @classmethod
     def set_confs(cls, name, confs):
-        cls._pool_confs[name] = confs
+        with cls._lock:
+            cls._pool_confs[name] = confs
+            cls.disconnect(name)
         if len(cls._pool_confs) == 1:
             cls.set_default_name(name)
         return confs
 
     @classmethod
     def del_confs(cls, name):
-        if cls.has_name(name):
-            del cls._pool_confs[name]
+        with cls._lock:
+            if cls.has_name(name):
+                del cls._pool_confs[name]
+                cls.disconnect(name)
         if len(cls._pool_confs) == 1:
             cls.set_default_name(cls._pool_confs.keys()[0])
 
 
+_missing = object()
+
+
+def _is_path(key):
+    return isinstance(key, basestring) and '.' in key
+
+
+def _overlaps(path, other):
+    return (path == other
+            or path.startswith(other + '.')
+            or other.startswith(path + '.'))
+
+
+def _get_path(value, parts, default=_missing):
+    for part in parts:
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+
+def _set_path(value, parts, new):
+    """Return a copy of `value` holding `new` at `parts`."""
+    if not parts:
+        return new
+    part, rest = parts[0], parts[1:]
+    if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+        value = list(value)
+        value[int(part)] = _set_path(value[int(part)], rest, new)
+        return value
+    if value is _missing:
+        value = {}
+    elif not isinstance(value, dict):
+        raise KeyError(part)
+    value = dict(value)
+    value[part] = _set_path(value.get(part, _missing), rest, new)
+    return value
+
+
+def _unset_path(value, parts):
+    """Return a copy of `value` without the field at `parts`."""
+    part, rest = parts[0], parts[1:]
+    if isinstance(value, dict) and part in value:
+        value = dict(value)
+        if rest:
+            value[part] = _unset_path(value[part], rest)
+        else:
+            del value[part]
+    elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+        # like mongodb, unsetting an array element leaves a null behind
+        value = list(value)
+        value[int(part)] = _unset_path(value[int(part)], rest) if rest else None
+    return value
+
+
+def _copy_doc(value):
+    if isinstance(value, dict):
+        return {k: _copy_doc(v) for k, v in value.iteritems()}
+    if isinstance(value, list):
+        return [_copy_doc(v) for v in value]
+    return value
+
+
+def _decode(value):
+    # values of raw documents are decoded into plain dicts and lists
+    if RawBSONDocument is not None:
+        if isinstance(value, RawBSONDocument):
+            return bson.BSON(value.raw).decode()
+        if isinstance(value, list):
+            return [_decode(v) for v in value]
+    return value
+
+
+def _same(a, b):
+    """Whether `a` and `b` are stored alike, unlike == for 1, 1.0 and True."""
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return isinstance(a, basestring) and isinstance(b, basestring) and a == b
+    if type(a) is dict:
+        return len(a) == len(b) and all(k in b and _same(v, b[k]) for k, v in a.iteritems())
+    if type(a) in (list, tuple):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _diff(old, new, path, sets, unsets):
+    """Collect the $set/$unset paths turning `old` into `new` at `path`."""
+    if (type(old) is dict and type(new) is dict
+            and all(isinstance(k, basestring) and '.' not in k and not k.startswith('$')
+                    for k in chain(old, new))):
+        for key, value in new.iteritems():
+            if key not in old:
+                sets[path + '.' + key] = value
+            elif not _same(old[key], value):
+                _diff(old[key], value, path + '.' + key, sets, unsets)
+        for key in old:
+            if key not in new:
+                unsets[path + '.' + key] = ""
+    else:
+        sets[path] = new
+
+
+def _validate_chunk(module, name, docs):
+    # run in pool workers, which import the class instead of unpickling it
+    cls = getattr(importlib.import_module(module), name)
+    return list(cls.validate_many(docs))
+
+
+def _read_bson(stream):
+    while True:
+        size = stream.read(4)
+        if not size:
+            return
+        yield bson.BSON(size + stream.read(struct.unpack('<i', size)[0] - 4)).decode()
+
+
+def _read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield json_util.loads(line)
+
+
+def _shape(value):
+    # a query with its values left out
+    if isinstance(value, dict):
+        return tuple(sorted((k, _shape(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted(set(_shape(v) for v in value)))
+    return None
+
+
+def _scans(plan):
+    """Tell whether a winning plan of explain() has a COLLSCAN stage."""
+    if isinstance(plan, dict):
+        return (plan.get('stage') == 'COLLSCAN'
+                or any(_scans(v) for k, v in plan.iteritems() if k != 'rejectedPlans'))
+    if isinstance(plan, list):
+        return any(_scans(v) for v in plan)
+    return False
+
+
 _schema_of_structure = Schema({
     #Optional('_id'): Or(object, Default(bson.ObjectId, force_value=True)),
     Or(
@@ -123,16 +323,35 @@ class _DocumentMetaClass(type):
             return type.__new__(cls, name, bases, attrs)
         attrs['__abstract__'] = False
 
-        for name, value in attrs.iteritems():
-            if name in ('_id',
+        for attr in attrs:
+            if attr in ('_id',
                         '_doc',
                         '_changed_doc',
                         '_removed_doc',
                         '_ex_doc',
                         '_schema',
+                        '_validator',
+                        '_id_validator',
+                        '_partial_validators',
+                        '_field_names',
+                        '_collection_cache',
+                        '_cache',
+                        '_ops',
+                        '_nested',
+                        '_unchecked',
+                        '_snapshot',
+                        '_exposed',
+                        '_unloaded',
+                        '_raw',
+                        '_buffer',
+                        '_explained',
+                        '_server_validator',
+                        '_server_validated',
+                        '_timed',
+                        '_required_fields',
                         '_in_db',
                         '_changed'):
-                raise AttributeError("Please don't use reserved attribute name `%s`" % name)
+                raise AttributeError("Please don't use reserved attribute name `%s`" % attr)
 
         collection = attrs.get('__collection__')
         if not collection:
@@ -156,32 +375,94 @@ class _DocumentMetaClass(type):
             structure[Optional('_id')] = Or(object, Default(bson.ObjectId))
 
         structure = _schema_of_structure.validate(structure)
-        attrs['_schema'] = Schema(structure)
-        attrs.setdefault('indices',
-                         _schema_of_indices.validate(getattr(bases[0], 'indices', [])))
+        schema = attrs['_schema'] = Schema(structure)
+        attrs['_validator'] = staticmethod(schema.compile())
+        attrs['_id_validator'] = staticmethod(schema.compile_partial(
+            k for k in structure
+            if k == '_id' or (isinstance(k, Optional) and k._schema == '_id')))
+        # partial validators are cached by the set of keys they validate
+        attrs['_partial_validators'] = {}
+        attrs['_field_names'] = frozenset(
+            k._schema if isinstance(k, Optional) else k for k in structure)
+        attrs['_required_fields'] = frozenset(
+            k for k in structure if not isinstance(k, Optional))
+        attrs['_collection_cache'] = None
+        attrs['indices'] = _schema_of_indices.validate(
+            attrs.get('indices', getattr(bases[0], 'indices', [])))
+        attrs['_explained'] = set()
+        attrs['_timed'] = None
 
         base_options = getattr(bases[0], '__options__', None)
         options = base_options.copy() if base_options else {}
         options.update(attrs.get('__options__', {}))
         attrs['__options__'] = options
 
-        return type.__new__(cls, name, bases, attrs)
+        if options.get('server_validation'):
+            # the fields enforced by the server `$jsonSchema` validator
+            # are written without being checked again
+            _, covered, _ = to_json_schema(structure)
+            fast = {}
+            for k, v in structure.iteritems():
+                if (k._schema if isinstance(k, Optional) else k) in covered:
+                    v = Or(object, default=v.default) if hasattr(v, 'default') else object
+                fast[k] = v
+            attrs['_server_validator'] = staticmethod(Schema(fast).compile())
+        else:
+            attrs['_server_validator'] = None
+        # whether the collection has the validator, None until looked up
+        attrs['_server_validated'] = None
+
+        cache = options.get('cache')
+        if cache:
+            attrs['_cache'] = DocumentCache(**cache) if isinstance(cache, dict) else DocumentCache()
+        else:
+            attrs['_cache'] = None
+
+        new_class = type.__new__(cls, name, bases, attrs)
+
+        write_behind = options.get('write_behind')
+        if write_behind:
+            if isinstance(write_behind, dict):
+                new_class._buffer = WriteBehindBuffer(new_class, **write_behind)
+            else:
+                new_class._buffer = WriteBehindBuffer(new_class)
+        else:
+            new_class._buffer = None
+
+        return new_class
+
+
+class DocumentCursor(object):
+    """Iterator building documents of `document_class` from a cursor."""
+
+    def __init__(self, document_class, cursor, unloaded=None, trusted=False):
+        self.document_class = document_class
+        self.cursor = cursor
+        self._unloaded = unloaded
+        self._trusted = trusted
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.document_class._from_db(next(self.cursor),
+                                            unloaded=self._unloaded,
+                                            trusted=self._trusted)
+
+    def close(self):
+        self.cursor.close()
 
 
 class Document(object):
     __metaclass__ = _DocumentMetaClass
     __abstract__ = True
+    __pool__ = None
 
     def __init__(self, *args, **kwargs):
         if not args and '_id' not in kwargs:
             raise TypeError("You must specify _id or initializing doc to create a document.")
 
-        self._id = None
-        self._doc = {}
-        self._changed_doc = {}
-        self._removed_doc = {}
-        self._changed = False
-        self._in_db = False
+        self._reset()
 
         if args[0]:
             if isinstance(args[0], dict):
@@ -194,38 +475,192 @@ class Document(object):
             self._id = self.validate_id(kwargs['_id'])
 
         if self._id:
-            self.refresh()
+            self._load_initial(trusted=kwargs.get('trusted'), fields=kwargs.get('fields'))
+
+    def _load_initial(self, trusted=None, fields=None):
+        if not self._load_cached():
+            self.refresh(trusted=trusted, fields=fields)
+
+    def _reset(self):
+        self._id = None
+        self._doc = {}
+        self._changed_doc = {}
+        self._removed_doc = {}
+        self._ops = {}
+        self._nested = False
+        self._unchecked = None
+        self._snapshot = None
+        self._exposed = None
+        self._unloaded = None
+        self._raw = None
+        self._changed = False
+        self._in_db = False
+
+    @classmethod
+    def _from_db(cls, doc, unloaded=None, trusted=False):
+        self = cls.__new__(cls)
+        self._reset()
+        self._load(doc, unloaded=unloaded, trusted=trusted)
+        return self
+
+    @classmethod
+    def _unloaded_fields(cls, projection):
+        """Return the top-level fields left out by `projection`."""
+        if projection is None:
+            return None
+        if isinstance(projection, dict):
+            if not projection.get('_id', True):
+                raise ValueError("Documents can't be loaded without their `_id`.")
+            included = [k for k, v in projection.iteritems() if v and k != '_id']
+            if not included:
+                excluded = frozenset(k for k, v in projection.iteritems() if not v)
+                if any(_is_path(k) for k in excluded):
+                    raise ValueError("Projection of nested fields is not supported.")
+                return excluded
+        else:
+            included = projection
+        if any(_is_path(k) for k in included):
+            raise ValueError("Projection of nested fields is not supported.")
+        return cls._field_names.difference(included, ['_id'])
+
+    @classmethod
+    def _trusted(cls, trusted):
+        return cls.__options__.get('trusted', False) if trusted is None else trusted
 
     @classmethod
     def validate_id(cls, _id):
-        s = Schema({k: v for k, v in cls._schema._schema.iteritems()
-                    if (k == '_id'
-                        or (isinstance(k, Optional)
-                            and k._schema == '_id'))
-                    })
-        return s.validate({'_id': _id})['_id']
+        if instrument.collector is None:
+            return cls._id_validator({'_id': _id})['_id']
+        return instrument.timed('validate_id', {'document': cls.__name__},
+                                cls._id_validator, {'_id': _id})['_id']
 
     @classmethod
     def validate_partial(cls, doc):
         assert isinstance(doc, dict)
-        s = Schema({k: v for k, v in cls._schema._schema.iteritems()
-                    if (k in doc
-                        or (isinstance(k, Optional)
-                            and k._schema in doc))
-                    })
-        return s.validate(doc)
+        if instrument.collector is None:
+            validator = cls._partial_validators.get(frozenset(doc))
+            if validator is None:
+                validator = cls._partial_validator(doc, cls._partial_validators)
+            return validator(doc)
+        _, fields, partials = cls._instrumented()
+        return instrument.timed('validate_partial', {'document': cls.__name__},
+                                cls._partial_validator(doc, partials, fields), doc)
+
+    @classmethod
+    def _partial_validator(cls, doc, cache, fields=None):
+        keys = frozenset(doc)
+        validator = cache.get(keys)
+        if validator is None:
+            validator = cls._schema.compile_partial(
+                (k for k in cls._schema._schema
+                 if (k in doc
+                     or (isinstance(k, Optional)
+                         and k._schema in doc))),
+                fields)
+            # unknown keys always fail validation, don't let them grow the cache
+            if keys <= cls._field_names:
+                cache[keys] = validator
+        return validator
 
     @classmethod
     def validate(cls, doc):
         assert isinstance(doc, dict)
-        return cls._schema.validate(doc)
+        if instrument.collector is None:
+            return cls._validator(doc)
+        return instrument.timed('validate', {'document': cls.__name__},
+                                cls._instrumented()[0], doc)
+
+    @classmethod
+    def validate_many(cls, docs, workers=None, chunk_size=1000):
+        """Validate the dicts of `docs`, yielding each result in order.
+
+        A document failing validation yields its SchemaError. With
+        `workers`, chunks of `chunk_size` documents are validated by a
+        pool of processes, which import the class by module and name.
+        """
+        if not workers:
+            for doc in docs:
+                try:
+                    yield cls.validate(doc)
+                except SchemaError as x:
+                    yield x
+            return
+
+        docs = iter(docs)
+        pool = multiprocessing.Pool(workers)
+        try:
+            pending = deque()
+            while True:
+                chunk = list(islice(docs, chunk_size))
+                if chunk:
+                    pending.append(pool.apply_async(
+                        _validate_chunk, (cls.__module__, cls.__name__, chunk)))
+                # a bounded number of chunks is in flight
+                if pending and (not chunk or len(pending) > 2 * workers):
+                    for result in pending.popleft().get():
+                        yield result
+                elif not chunk:
+                    break
+            pool.close()
+        finally:
+            pool.terminate()
+
+    @classmethod
+    def _validate_write(cls, doc):
+        assert isinstance(doc, dict)
+        if cls._server_validator is None or not cls._server_checks():
+            return cls.validate(doc)
+        if instrument.collector is None:
+            return cls._server_validator(doc)
+        return instrument.timed('validate', {'document': cls.__name__},
+                                cls._server_validator, doc)
+
+    @classmethod
+    def _server_checks(cls):
+        # whether the server rejects what `server_schema` rejects, looked
+        # up on first use unless set by apply_server_schema
+        if cls._server_validated is None:
+            try:
+                options = cls.get_collection().options()
+            except OperationFailure:
+                options = {}
+            cls._server_validated = (
+                options.get('validator') == {'$jsonSchema': cls.server_schema()[0]}
+                and options.get('validationLevel', 'strict') == 'strict'
+                and options.get('validationAction', 'error') == 'error')
+        return cls._server_validated
+
+    @classmethod
+    def _instrumented(cls):
+        # validators measuring every field, built when first measured
+        if cls._timed is None:
+            fields = dict((k, instrument.timed_field(cls.__name__, k, v))
+                          for k, v in cls._schema._field_validators().iteritems())
+            validator = cls._schema.compile_partial(cls._schema._schema, fields)
+            cls._timed = (validator, fields, {})
+        return cls._timed
+
+    @classmethod
+    def _db_call(cls, op, payload, method, *args, **kwargs):
+        if instrument.collector is None:
+            return method(*args, **kwargs)
+        return instrument.db_call(cls.__name__, op, method, args, kwargs, payload)
 
     def _clean(self):
         self._changed_doc = {}
         self._removed_doc = {}
+        self._ops = {}
+        self._nested = False
         self._changed = False
 
     def _blur(self, changed_doc=None, removed_fields=None):
+        if self._nested:
+            for key in removed_fields or ():
+                self._track(key, unset=True)
+            for key in changed_doc or ():
+                self._track(key)
+            return
+
         if removed_fields:
             for key in removed_fields:
                 if key in self._changed_doc:
@@ -239,23 +674,410 @@ class Document(object):
                     del self._removed_doc[key]
 
         self._changed = True
+        self._raw = None
+
+    def _pending(self):
+        return [('$set', self._changed_doc), ('$unset', self._removed_doc)] + self._ops.items()
+
+    def _track(self, path, unset=False):
+        """Record `path` as set or unset, keeping pending paths disjoint.
+
+        A path below one already pending is folded into its ancestor.
+        """
+        parts = path.split('.')
+        for i in xrange(1, len(parts)):
+            ancestor = '.'.join(parts[:i])
+            if any(ancestor in paths for _, paths in self._pending()):
+                path, parts = ancestor, parts[:i]
+                unset = _get_path(self._doc, parts) is _missing
+                break
+
+        prefix = path + '.'
+        for _, paths in self._pending():
+            for key in [k for k in paths if k == path or k.startswith(prefix)]:
+                del paths[key]
+
+        if unset:
+            self._removed_doc[path] = ""
+        else:
+            self._changed_doc[path] = _get_path(self._doc, parts)
+        self._nested = True
+        self._changed = True
+        self._raw = None
+
+    def _queue(self, op, path, arg, merge):
+        for pending_op, paths in self._pending():
+            for key in paths:
+                if _overlaps(key, path) and (pending_op, key) != (op, path):
+                    return self._track(path)
+
+        paths = self._ops.setdefault(op, {})
+        paths[path] = merge(paths[path], arg) if path in paths else arg
+        self._nested = True
+        self._changed = True
+        self._raw = None
 
-    def refresh(self):
+    def _store(self, parts, field):
+        doc = self.validate_partial({parts[0]: field})
+        self._doc.update(doc)
+        if self._unchecked:
+            self._unchecked.discard(parts[0])
+        return _get_path(doc[parts[0]], parts[1:])
+
+    def _set(self, path, value):
+        parts = path.split('.')
+        if self._unloaded or self._unchecked:
+            self._ensure(parts[0])
+        self._store(parts, _set_path(self._doc.get(parts[0], _missing), parts[1:], value))
+        self._track(path)
+
+    def _unset(self, path):
+        parts = path.split('.')
+        if self._unloaded or self._unchecked:
+            self._ensure(parts[0])
+        if parts[0] in self._doc:
+            self._store(parts, _unset_path(self._doc[parts[0]], parts[1:]))
+        self._track(path, unset=True)
+
+    def _modify(self, op, path, arg, value, merge=operator.add):
+        # apply the operator locally, an operator whose result the schema
+        # converts is sent as a $set of the converted value instead
+        parts = path.split('.')
+        field = _set_path(self._doc.get(parts[0], _missing), parts[1:], value)
+        if self._store(parts, field) == value:
+            self._queue(op, path, arg, merge)
+        else:
+            self._track(path)
+
+    def inc(self, key, amount=1):
+        """Increment `key` by `amount`, sent as `$inc` on commit."""
+        self._modify('$inc', key, amount, self._get(key, 0) + amount)
+
+    def push(self, key, *values):
+        """Append `values` to the array `key`, sent as `$push` on commit."""
+        value = list(self._get(key) or []) + list(values)
+        self._modify('$push', key, {'$each': list(values)}, value, _merge_each)
+
+    def add_to_set(self, key, *values):
+        """Add missing `values` to the array `key`, sent as `$addToSet`."""
+        value = list(self._get(key) or [])
+        for v in values:
+            if v not in value:
+                value.append(v)
+        self._modify('$addToSet', key, {'$each': list(values)}, value, _merge_each)
+
+    def pull(self, key, *values):
+        """Remove `values` from the array `key`, sent as `$pullAll`."""
+        value = [v for v in self._get(key) or [] if v not in values]
+        self._modify('$pullAll', key, list(values), value)
+
+    def refresh(self, trusted=None, fields=None):
+        """Load the document from the database.
+
+        `fields` loads only the given top-level fields, the others are
+        fetched when first read or raise KeyError if the class option
+        `fetch_unloaded` is False. Saving never overwrites them.
+        """
         if self._id is None:
             raise KeyError("`_id` is None.")
+        unloaded = self._unloaded_fields(fields)
+        if self._buffer is not None:
+            self._buffer.flush(self._id)
 
-        doc = self.collection.find_one({'_id': self._id})
+        doc = self._db_call('find_one', None, self._reader().find_one, {'_id': self._id}, fields)
         if doc is None:
             self._doc = {}
             self._in_db = False
+            self._uncache()
             return
 
-        self._doc = self.validate(doc)
+        trusted = self._trusted(trusted)
+        self._load(doc, unloaded=unloaded, trusted=trusted)
+        self._take_snapshot()
+        if (self._cache is not None and not trusted and unloaded is None
+                and self._raw is None):
+            self._cache.put(self._id, _copy_doc(self._doc))
+
+    def _load_cached(self):
+        if self._cache is None:
+            return False
+        doc = self._cache.get(self._id)
+        if doc is None:
+            return False
+        self._doc = _copy_doc(doc)
+        self._clean()
+        self._in_db = True
+        self._take_snapshot()
+        return True
+
+    def _take_snapshot(self):
+        # replace saves of documents loaded by _id only send what changed
+        # since the snapshot, unless the `diff_threshold` option is None.
+        # Values are replaced on change, so the snapshot keeps the loaded
+        # ones by reference; fields handed out by get() are `_exposed` to
+        # changes in place.
+        if self.__options__.get('diff_threshold', 0.5) is not None:
+            self._snapshot = dict(self._doc)
+            self._exposed = set()
+
+    def _uncache(self):
+        if self._cache is not None:
+            self._cache.discard(self._id)
+
+    @classmethod
+    def cache_stats(cls):
+        """Return the counters of the class cache, None if it has none."""
+        return cls._cache.stats() if cls._cache is not None else None
+
+    def _load(self, doc, unloaded=None, trusted=False):
+        if RawBSONDocument is not None and isinstance(doc, RawBSONDocument):
+            # raw documents are decoded one level, subdocuments stay raw
+            # until their field is read
+            self._raw = doc
+            doc = dict(doc.items())
+            trusted = True
+        if trusted:
+            # fields are validated when they are first read
+            self._doc = doc
+            self._unchecked = set(doc)
+            self._unchecked.discard('_id')
+        else:
+            self._doc = self.validate(doc) if unloaded is None else self.validate_partial(doc)
+            self._unchecked = None
+        self._unloaded = set(unloaded) if unloaded is not None else None
         self._id = self.validate_id(self._doc['_id'])
 
         self._clean()
         self._in_db = True
 
+    def _ensure(self, key):
+        # load and validate `key` for a document loaded partially or trusted
+        if self._unloaded and key in self._unloaded:
+            self._fetch(key)
+        if self._unchecked and key in self._unchecked:
+            self._doc.update(self.validate_partial({key: _decode(self._doc[key])}))
+            self._unchecked.discard(key)
+
+    def _fetch(self, key):
+        if not self.__options__.get('fetch_unloaded', True):
+            raise KeyError("Field `%s` is not loaded." % key)
+        doc = self._db_call('find_one', None, self._reader().find_one, {'_id': self._id}, [key])
+        self._unloaded.discard(key)
+        if doc is not None and key in doc:
+            doc = self.validate_partial({key: _decode(doc[key])})
+            self._doc.update(doc)
+            if self._snapshot is not None:
+                self._snapshot[key] = doc[key]
+
+    def verify(self):
+        """Validate every field of a document loaded in trusted mode."""
+        if self._unchecked is not None:
+            if self._unloaded is None:
+                self._doc = self.validate(self._decoded())
+            else:
+                self._doc = self.validate_partial(self._decoded())
+            self._unchecked = None
+
+    def _decoded(self):
+        if not self._unchecked:
+            return self._doc
+        return {k: _decode(v) if k in self._unchecked else v
+                for k, v in self._doc.iteritems()}
+
+    @classmethod
+    def find(cls, filter=None, projection=None, sort=None, limit=0, batch_size=0,
+             trusted=None):
+        """Return a lazy iterator of loaded documents matching `filter`.
+
+        Documents are built from the cursor batches as they arrive, a
+        `projection` loads them partially, see `refresh`. `trusted` loads
+        them as stored and validates each field when it is first read,
+        it defaults to the `trusted` option of the class.
+        """
+        unloaded = cls._unloaded_fields(projection)
+        cls._explain(filter, sort)
+        cursor = cls._reader().find(filter, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return DocumentCursor(cls, cursor, unloaded=unloaded, trusted=cls._trusted(trusted))
+
+    @classmethod
+    def find_one(cls, filter=None, projection=None, sort=None, trusted=None):
+        unloaded = cls._unloaded_fields(projection)
+        cls._explain(filter, sort)
+        doc = cls._reader().find_one(filter, projection, sort=sort)
+        if doc is None:
+            return None
+        return cls._from_db(doc, unloaded=unloaded, trusted=cls._trusted(trusted))
+
+    @classmethod
+    def paginate(cls, filter=None, sort_key=('_id', 1), page_size=100, after=None,
+                 trusted=None):
+        """Return a page of documents following the token `after`.
+
+        Pages are read with range queries on `sort_key`, ties are broken
+        by `_id`. Unless it is `_id`, one of `indices` must start with the
+        `sort_key` field followed by `_id`, in the same or both reversed
+        directions, so that every page is read from the index without
+        sorting. Returns the documents and the token of the next page,
+        None after the last one.
+        """
+        field, direction = sort_key
+        if field != '_id':
+            prefixes = ([(field, direction), ('_id', direction)],
+                        [(field, -direction), ('_id', -direction)])
+            if not any([tuple(f) for f in index['fields'][:2]] in prefixes
+                       for index in cls.indices):
+                raise ValueError("Can't paginate on `%s`, no index starts with it and `_id`."
+                                 % field)
+
+        query = filter or {}
+        if after is not None:
+            try:
+                last = bson.BSON(base64.urlsafe_b64decode(str(after))).decode()
+            except (TypeError, ValueError, bson.errors.BSONError):
+                last = {}
+            if set(last) != set('fdki'):
+                raise ValueError("Malformed page token %r." % (after,))
+            if (last['f'], last['d']) != (field, direction):
+                raise ValueError("Token doesn't match sort key %r." % (sort_key,))
+            op = '$gt' if direction > 0 else '$lt'
+            if field == '_id':
+                range_ = {'_id': {op: last['i']}}
+            else:
+                range_ = {'$or': [{field: {op: last['k']}},
+                                  {field: last['k'], '_id': {op: last['i']}}]}
+            query = {'$and': [query, range_]} if query else range_
+
+        sort = [(field, direction)]
+        if field != '_id':
+            sort.append(('_id', direction))
+        cls._explain(query, sort)
+        # one more document tells whether a next page exists
+        cursor = cls._reader().find(query).sort(sort).limit(page_size + 1)
+        raws = list(cursor.batch_size(page_size + 1))
+
+        token = None
+        if len(raws) > page_size:
+            raws = raws[:page_size]
+            top, _, rest = field.partition('.')
+            key = _decode(raws[-1].get(top))
+            if rest:
+                key = _get_path(key, rest.split('.'), None)
+            token = base64.urlsafe_b64encode(bson.BSON.encode({
+                'f': field, 'd': direction, 'k': key, 'i': raws[-1]['_id']}))
+        trusted = cls._trusted(trusted)
+        return [cls._from_db(doc, trusted=trusted) for doc in raws], token
+
+    @classmethod
+    def export(cls, stream, format='bson', filter=None, trusted=False, batch_size=1000,
+               progress=None):
+        """Write the documents matching `filter` to the binary file `stream`.
+
+        `format` is 'bson', documents concatenated like mongodump writes
+        them, or 'ndjson', one extended JSON document per line. Documents
+        are validated unless `trusted`. `progress(count)` is called after
+        every batch. Returns the number of documents written.
+        """
+        if format not in ('bson', 'ndjson'):
+            raise ValueError("Unknown format `%s`." % format)
+        cls._explain(filter, None)
+        cursor = cls._reader().find(filter).batch_size(batch_size)
+        if not trusted:
+            cursor = DocumentCursor(cls, cursor, trusted=False)
+
+        count = 0
+        for doc in cursor:
+            if not trusted:
+                # raw documents are loaded trusted
+                doc.verify()
+                doc = doc._doc
+            if format == 'ndjson':
+                stream.write(json_util.dumps(doc) + '\n')
+            elif RawBSONDocument is not None and isinstance(doc, RawBSONDocument):
+                stream.write(doc.raw)
+            else:
+                stream.write(bson.BSON.encode(doc))
+            count += 1
+            if progress is not None and count % batch_size == 0:
+                progress(count)
+        if progress is not None and count % batch_size:
+            progress(count)
+        return count
+
+    @classmethod
+    def import_(cls, stream, format='bson', trusted=False, batch_size=1000, progress=None):
+        """Write the documents read from `stream` in bulk batches.
+
+        The formats are the ones of `export`. Documents with an `_id`
+        replace the stored ones. They are validated unless `trusted`.
+        `progress(count)` is called after every batch. Returns the number
+        of documents written.
+        """
+        if format == 'bson':
+            docs = _read_bson(stream)
+        elif format == 'ndjson':
+            docs = _read_ndjson(stream)
+        else:
+            raise ValueError("Unknown format `%s`." % format)
+
+        collection = cls.get_collection()
+        count = 0
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            if trusted:
+                bulk = collection.initialize_unordered_bulk_op()
+                for doc in batch:
+                    if '_id' in doc:
+                        bulk.find({'_id': doc['_id']}).upsert().replace_one(doc)
+                    else:
+                        bulk.insert(doc)
+                cls._db_call('bulk', None, bulk.execute)
+                if cls._cache is not None:
+                    for doc in batch:
+                        if '_id' in doc:
+                            cls._cache.discard(doc['_id'])
+            else:
+                cls._bulk_save([cls(doc) for doc in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    @classmethod
+    def get_many(cls, ids, chunk_size=1000, skip_missing=False, trusted=None):
+        """Load the documents of `ids` with chunked `$in` queries.
+
+        Documents are returned in the order of `ids`, missing ones as None
+        unless `skip_missing` is set.
+        """
+        ids = [cls.validate_id(_id) for _id in ids]
+        seen = set()
+        unique_ids = [_id for _id in ids if not (_id in seen or seen.add(_id))]
+        if cls._buffer is not None and any(_id in cls._buffer for _id in unique_ids):
+            cls._buffer.flush()
+
+        trusted = cls._trusted(trusted)
+        collection = cls._reader()
+        found = {}
+        for i in xrange(0, len(unique_ids), chunk_size):
+            chunk = unique_ids[i:i + chunk_size]
+            cursor = collection.find({'_id': {'$in': chunk}}).batch_size(len(chunk))
+            for doc in cursor:
+                doc = cls._from_db(doc, trusted=trusted)
+                found[doc._id] = doc
+
+        docs = [found.get(_id) for _id in ids]
+        if skip_missing:
+            return [doc for doc in docs if doc is not None]
+        return docs
+
     def __len__(self):
         return len(self._doc) if self._doc else 0
 
@@ -264,78 +1086,372 @@ class Document(object):
 
     @classmethod
     def get_collection(cls):
-        return Pools.get_database()[cls.__collection__]
+        Pools._check_pid()
+        key = (cls.__pool__, Pools._generation)
+        cache = cls._collection_cache
+        if cache is None or cache[0] != key:
+            collection = Pools.get_database(cls.__pool__)[cls.__collection__]
+            cache = cls._collection_cache = (key, collection)
+        return cache[1]
+
+    @classmethod
+    def _reader(cls):
+        # with the `raw` option documents are fetched as RawBSONDocument
+        collection = cls.get_collection()
+        if not cls.__options__.get('raw'):
+            return collection
+        if RawBSONDocument is None:
+            raise RuntimeError("The `raw` option requires pymongo>=3.2.")
+        return collection.with_options(
+            codec_options=collection.codec_options._replace(document_class=RawBSONDocument))
 
     @property
     def collection(self):
         return self.__class__.get_collection()
 
-    def save(self, replace=True, refresh=False, *args, **kwargs):
-        if not self._changed:
-            return
-
-        if replace or not self._in_db:
-            self._doc = self.validate(self._doc)
-            _id = self.collection.save(self._doc, *args, **kwargs)
-            self._id = self.validate_id(_id)
+    def _prepare_write(self, replace):
+        """Validate pending changes for a write.
 
-        elif self._changed:
-            if self._removed_doc:
-                self.collection.update({'_id': self._id}, {'$unset': self._removed_doc}, *args, **kwargs)
+        Return None when the whole document has to be written, otherwise
+        the update operators to apply.
+        """
+        if replace and self._in_db:
+            if self._snapshot is not None:
+                update = self._diff_update()
+                if update is not None:
+                    return update
+            if self._unloaded is not None:
+                return self._loaded_update()
 
+        if replace or not self._in_db:
+            if self._raw is not None:
+                # unchanged since loaded, written back from its raw bytes
+                return None
+            self._doc = self._validate_write(self._decoded())
+            self._unchecked = None
+            return None
+
+        update = {}
+        if self._nested:
+            # nested paths were validated with their field when they were set
+            _changed_doc = self.validate_partial({k: v for k, v in self._changed_doc.iteritems()
+                                                  if not _is_path(k)})
+            _changed_doc.update((k, v) for k, v in self._changed_doc.iteritems()
+                                if _is_path(k))
+        else:
             _changed_doc = self.validate_partial(self._changed_doc)
-            if _changed_doc:
-                self.collection.update({'_id': self._id}, {'$set': _changed_doc}, *args, **kwargs)
-
+        if _changed_doc:
+            update['$set'] = _changed_doc
+        if self._removed_doc:
+            update['$unset'] = self._removed_doc
+        for op, paths in self._ops.iteritems():
+            if paths:
+                update[op] = paths
+        return update
+
+    def _diff_update(self):
+        snapshot, doc = self._snapshot, self._doc
+        # fields still holding a handed out value are compared to nothing
+        touched = set(k for k in self._exposed if k in doc and doc[k] is snapshot.get(k))
+        changed = [k for k in doc if k in touched or k not in snapshot
+                   or not _same(doc[k], snapshot[k])]
+        removed = [k for k in snapshot if k not in doc]
+        if self._unloaded is not None:
+            # fields deleted without being loaded
+            removed.extend(k for k in self._removed_doc
+                           if not _is_path(k) and k not in snapshot and k not in doc)
+        # a partially loaded document is never replaced
+        if self._unloaded is None and (
+                len(changed) + len(removed) > self.__options__.get('diff_threshold', 0.5) * len(snapshot)
+                or '_id' in changed
+                or self._required_fields.intersection(removed)):
+            return None
+
+        # unchanged fields were validated when loaded
+        validated = self.validate_partial({k: doc[k] for k in changed})
+        doc.update(validated)
+        if self._unchecked:
+            self._unchecked.difference_update(validated)
+        sets, unsets = {}, {}
+        for key, value in validated.iteritems():
+            old = _missing if key in touched else _decode(snapshot.get(key, _missing))
+            _diff(old, value, key, sets, unsets)
+        for key in removed:
+            unsets[key] = ""
+
+        update = {}
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = unsets
+        return update
+
+    def _loaded_update(self):
+        sets = self.validate_partial({k: v for k, v in self._decoded().iteritems() if k != '_id'})
+        self._doc.update(sets)
+        self._unchecked = None
+        unsets = {k: v for k, v in self._removed_doc.iteritems()
+                  if k.split('.', 1)[0] not in sets}
+
+        update = {}
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = unsets
+        return update
+
+    def _written(self, update):
+        self._uncache()
+        if self._snapshot is not None:
+            if update is None:
+                self._snapshot = dict(self._doc)
+            else:
+                for key in set(path.split('.', 1)[0] for paths in update.itervalues() for path in paths):
+                    if key in self._doc:
+                        self._snapshot[key] = self._doc[key]
+                    else:
+                        self._snapshot.pop(key, None)
         self._clean()
         self._in_db = True
 
+    def save(self, replace=True, refresh=False, *args, **kwargs):
+        if not self._changed:
+            return
+        if self._buffer is not None and self._id is not None:
+            # commits buffered before are written first
+            self._buffer.flush(self._id)
+
+        update = self._prepare_write(replace)
+        if update is None:
+            doc = self._raw if self._raw is not None else self._doc
+            _id = self._db_call('save', doc, self.collection.save, doc, *args, **kwargs)
+            self._id = self.validate_id(_id)
+        elif update:
+            self._db_call('update', update, self.collection.update,
+                          {'_id': self._id}, update, *args, **kwargs)
+
+        self._written(update)
+
         if refresh:
             self.refresh()
         return self._id
 
+    @classmethod
+    def bulk_save(cls, docs, replace=True, ordered=False, chunk_size=1000, **kwargs):
+        """Save `docs` with bulk writes of up to `chunk_size` operations.
+
+        Each document is written the way `save(replace)` would write it.
+        Returns the `_id` of every document.
+        """
+        return cls._bulk_save(docs, replace, ordered, chunk_size, **kwargs)
+
+    @classmethod
+    def _bulk_save(cls, docs, replace=True, ordered=False, chunk_size=1000, **kwargs):
+        docs = list(docs)
+        changed = []
+        for doc in docs:
+            assert isinstance(doc, cls)
+            if doc._changed:
+                changed.append(doc)
+        if cls._buffer is not None and any(doc._id in cls._buffer for doc in changed):
+            cls._buffer.flush()
+
+        collection = cls.get_collection()
+        for i in xrange(0, len(changed), chunk_size):
+            chunk = changed[i:i + chunk_size]
+            if ordered:
+                bulk = collection.initialize_ordered_bulk_op()
+            else:
+                bulk = collection.initialize_unordered_bulk_op()
+
+            has_ops = False
+            updates = []
+            for doc in chunk:
+                update = doc._prepare_write(replace)
+                updates.append(update)
+                if update is None:
+                    if doc._raw is not None:
+                        bulk.find({'_id': doc._id}).upsert().replace_one(doc._raw)
+                    elif '_id' in doc._doc:
+                        bulk.find({'_id': doc._doc['_id']}).upsert().replace_one(doc._doc)
+                    else:
+                        doc._doc['_id'] = bson.ObjectId()
+                        bulk.insert(doc._doc)
+                elif update:
+                    bulk.find({'_id': doc._id}).update_one(update)
+                else:
+                    continue
+                has_ops = True
+            if has_ops:
+                cls._db_call('bulk', None, bulk.execute, **kwargs)
+
+            for doc, update in zip(chunk, updates):
+                if update is None:
+                    doc._id = cls.validate_id(doc._doc['_id'])
+                doc._written(update)
+
+        return [doc._id for doc in docs]
+
     def commit(self, refresh=False, *args, **kwargs):
+        """Write the changes, into the write-behind buffer if the class has one.
+
+        See `WriteBehindBuffer` for when buffered changes reach the database.
+        """
+        if self._buffer is not None and self._in_db and not refresh:
+            if not self._changed:
+                return
+            update = self._prepare_write(False)
+            if update:
+                self._buffer.add(self._id, update)
+            self._written(update)
+            return self._id
         return self.save(replace=False, refresh=refresh, *args, **kwargs)
 
     def get(self, key, default=None):
         if not isinstance(key, tuple):
-            return self._doc.get(key, default)
-        return {k: self._doc.get(k, default) for k in key}
+            value = self._get(key, default)
+            if self._exposed is not None and isinstance(value, (dict, list)):
+                self._exposed.add(key.split('.', 1)[0])
+            return value
+        return {k: self.get(k, default) for k in key}
+
+    def _get(self, key, default=None):
+        if self._unchecked or self._unloaded:
+            self._ensure(key.split('.', 1)[0] if _is_path(key) else key)
+        if _is_path(key) and key not in self._doc:
+            return _get_path(self._doc, key.split('.'), default)
+        return self._doc.get(key, default)
 
     def __getitem__(self, key):
         return self.get(key)
 
     def __delitem__(self, key):
         keys = (key,) if not isinstance(key, tuple) else key
-        for name in keys:
+        fields = [name for name in keys if not _is_path(name)]
+        for name in fields:
             if name in self._doc:
                 del self._doc[name]
-        self._blur(removed_fields=keys)
+            if self._unchecked:
+                self._unchecked.discard(name)
+            if self._unloaded:
+                self._unloaded.discard(name)
+        if fields or not keys:
+            self._blur(removed_fields=fields)
+        for name in keys:
+            if _is_path(name):
+                self._unset(name)
 
     def __setitem__(self, key, value):
         self.update({key: value})
 
     def update(self, doc):
+        paths = {key: doc[key] for key in doc if _is_path(key)}
+        if paths:
+            doc = {key: value for key, value in doc.iteritems() if key not in paths}
         doc = self.validate_partial(doc)
         self._doc.update(doc)
+        if self._unchecked:
+            self._unchecked.difference_update(doc)
+        if self._unloaded:
+            self._unloaded.difference_update(doc)
         self._blur(changed_doc=doc)
+        for path, value in paths.iteritems():
+            self._set(path, value)
 
     def remove(self, *args, **kwargs):
         if not self._in_db:
             return
-        self.collection.remove({'_id': self._id}, *args, **kwargs)
+        if self._buffer is not None:
+            self._buffer.flush(self._id)
+        self._db_call('remove', None, self.collection.remove, {'_id': self._id}, *args, **kwargs)
+        self._uncache()
+        self._snapshot = None
+        self._exposed = None
         self._clean()
         self._changed = True
         self._in_db = False
 
     @classmethod
     def ensure_indices(cls):
-        if not cls._indices:
-            return
+        """Create the declared `indices` missing from the collection."""
+        return cls.sync_indices()['created']
 
-        collection = cls.collection
-        for index in cls._indices:
-            fields = cls._indices['fields']
-            kwargs = {key: value for key, value in cls._indices.iteritems()
-                      if key != 'fields'}
-            collection.ensure_index(fields, **kwargs)
+    @classmethod
+    def sync_indices(cls, drop=False):
+        """Compare the declared `indices` with the ones of the collection.
+
+        Missing indexes are created in the background. Returns the names
+        of the created ones and of the existing undeclared ones, which
+        are dropped too if `drop` is set.
+        """
+        collection = cls.get_collection()
+        existing = {}
+        for name, info in collection.index_information().iteritems():
+            existing[tuple(tuple(field) for field in info['key'])] = name
+
+        declared = set()
+        created = []
+        for index in cls.indices:
+            key = tuple(tuple(field) for field in index['fields'])
+            declared.add(key)
+            if key not in existing:
+                kwargs = {k: v for k, v in index.iteritems() if k != 'fields'}
+                kwargs.setdefault('background', True)
+                created.append(collection.create_index(list(key), **kwargs))
+
+        undeclared = [name for key, name in existing.iteritems()
+                      if key not in declared and name != '_id_']
+        if drop:
+            for name in undeclared:
+                collection.drop_index(name)
+        return {'created': created, 'undeclared': undeclared}
+
+    @classmethod
+    def server_schema(cls):
+        """Translate `structure` into a `$jsonSchema`, see `to_json_schema`."""
+        return to_json_schema(cls._schema._schema)
+
+    @classmethod
+    def apply_server_schema(cls, level='strict', action='error'):
+        """Install the `server_schema` validator on the collection.
+
+        Returns the nodes of `structure` the server can't check. With the
+        `server_validation` option the fields it fully checks are not
+        validated again by the client when writing whole documents, once
+        a strict validator rejecting writes is installed.
+        """
+        schema, _, untranslated = cls.server_schema()
+        options = {
+            'validator': {'$jsonSchema': schema},
+            'validationLevel': level,
+            'validationAction': action,
+        }
+        database = Pools.get_database(cls.__pool__)
+        try:
+            database.command('collMod', cls.__collection__, **options)
+        except OperationFailure as x:
+            if x.code != 26:  # NamespaceNotFound
+                raise
+            database.create_collection(cls.__collection__, **options)
+        cls._server_validated = level == 'strict' and action == 'error'
+        return untranslated
+
+    @classmethod
+    def _explain(cls, filter, sort=None):
+        # with the `explain_queries` option, the plan of each new filter
+        # shape is checked for collection scans
+        if not cls.__options__.get('explain_queries') or not filter:
+            return
+        shape = (_shape(filter), repr(sort))
+        if shape in cls._explained:
+            return
+        cls._explained.add(shape)
+
+        cursor = cls.get_collection().find(filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()
+        if ('queryPlanner' in plan and _scans(plan['queryPlanner']['winningPlan'])
+                or plan.get('cursor') == 'BasicCursor'):
+            warnings.warn("Query %r on `%s` scans the collection." % (filter, cls.__collection__),
+                          CollectionScanWarning, stacklevel=3)
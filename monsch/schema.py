@@ -2,12 +2,54 @@
 
 
 class SchemaError(Exception):
-    """Error during Schema validation."""
+    """Error during Schema validation.
 
-    def __init__(self, autos, errors):
-        self.autos = autos if type(autos) is list else [autos]
-        self.errors = errors if type(errors) is list else [errors]
-        Exception.__init__(self, self.code)
+    `path` holds the keys leading to the failing `value`, `schema` is the
+    node it failed. Messages are formatted when `autos`, `errors` or
+    `code` is first read.
+    """
+
+    def __init__(self, autos, errors, schema=None, value=None):
+        # an auto message is a string or a lazy (format, args) pair
+        self._autos = autos if type(autos) is list else [autos]
+        self._errors = errors if type(errors) is list else [errors]
+        self.path = ()
+        self.schema = schema
+        self.value = value
+        Exception.__init__(self)
+
+    def __str__(self):
+        return self.code
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.code)
+
+    @property
+    def args(self):
+        return (self.code,)
+
+    @property
+    def message(self):
+        return self.code
+
+    def __reduce__(self):
+        # the schema and lazy messages may hold unpicklable callables
+        return SchemaError, (self.autos, self.errors), {'path': self.path, 'value': self.value}
+
+    def _chain(self, auto, error):
+        # the error as seen from an enclosing node
+        x = SchemaError([auto] + self._autos, [error] + self._errors,
+                        self.schema, self.value)
+        x.path = self.path
+        return x
+
+    @property
+    def autos(self):
+        return [a[0] % a[1] if type(a) is tuple else a for a in self._autos]
+
+    @property
+    def errors(self):
+        return self._errors
 
     @property
     def code(self):
@@ -33,6 +75,16 @@ class Strategy(object):
     def validate(self, data):
         raise NotImplementedError
 
+    def compile(self):
+        """Return a callable validating data like `validate`, built once."""
+        compiled = self.__dict__.get('_compiled')
+        if compiled is None:
+            compiled = self._compiled = self._compile()
+        return compiled
+
+    def _compile(self):
+        return self.validate
+
 
 class And(Strategy):
 
@@ -45,22 +97,35 @@ class And(Strategy):
                            ', '.join(repr(a) for a in self._args))
 
     def validate(self, data):
-        for s in [Schema(s, error=self._error) for s in self._args]:
-            data = s.validate(data)
-        return data
+        return self.compile()(data)
+
+    def _compile(self):
+        validators = [_compile(s, self._error) for s in self._args]
+
+        def validate(data):
+            for v in validators:
+                data = v(data)
+            return data
+        return validate
 
 
 class Or(And):
 
-    def validate(self, data):
-        x = SchemaError([], [])
-        for s in [Schema(s, error=self._error) for s in self._args]:
-            try:
-                return s.validate(data)
-            except SchemaError as _x:
-                x = _x
-        raise SchemaError(['%r did not validate %r' % (self, data)] + x.autos,
-                          [self._error] + x.errors)
+    def _compile(self):
+        validators = [_compile(s, self._error) for s in self._args]
+        e = self._error
+
+        def validate(data):
+            x = None
+            for v in validators:
+                try:
+                    return v(data)
+                except SchemaError as _x:
+                    x = _x
+            if x is None:
+                raise SchemaError([('%r did not validate %r', (self, data))], [e], self, data)
+            raise x._chain(('%r did not validate %r', (self, data)), e)
+        return validate
 
 
 class Use(Strategy):
@@ -77,10 +142,10 @@ class Use(Strategy):
         try:
             return self._callable(data)
         except SchemaError as x:
-            raise SchemaError([None] + x.autos, [self._error] + x.errors)
+            raise x._chain(None, self._error)
         except BaseException as x:
-            f = self._callable.__name__
-            raise SchemaError('%s(%r) raised %r' % (f, data, x), self._error)
+            raise SchemaError(('%s(%r) raised %r', (self._callable.__name__, data, x)),
+                              self._error, self, data)
 
 
 class Default(Strategy):
@@ -100,7 +165,7 @@ class Default(Strategy):
             else:
                 return self._value
         except BaseException as x:
-            raise SchemaError('Default raised %r' % x, self._error)
+            raise SchemaError(('Default raised %r', (x,)), self._error, self)
 
 
 def priority(s):
@@ -138,107 +203,219 @@ class Schema(Strategy):
                 return self.default.validate()
             return self.default
 
-        data = args[0]
-        s = self._schema
-        e = self._error
+        return self.compile()(args[0])
 
-        if type(s) in (list, tuple, set, frozenset):
-            data = Schema(type(s), error=e).validate(data)
-            return type(s)(Or(*s, error=e).validate(d) for d in data)
+    def compile_partial(self, keys, fields=None):
+        """Return a validator for this dict schema restricted to `keys`.
 
-        if type(s) is dict:
-            data = Schema(dict, error=e).validate(data)
-            new = type(data)()  # new - is a dict of the validated values
-            x = None
-            coverage = set()  # non-optional schema keys that were matched
-            # for each key and value find a schema entry matching them, if any
-            sorted_skeys = list(sorted(s, key=priority))
-            for key, value in data.items():
-                valid = False
-                skey = None
-                for skey in sorted_skeys:
-                    svalue = s[skey]
-                    try:
-                        nkey = Schema(skey, error=e).validate(key)
-                    except SchemaError:
-                        pass
-                    else:
-                        try:
-                            nvalue = Schema(svalue, error=e).validate(value)
-                        except SchemaError as _x:
-                            x = _x
-                            raise
-                        else:
-                            coverage.add(skey)
-                            valid = True
-                            break
-                if valid:
-                    new[nkey] = nvalue
-                elif skey is not None:
-                    if x is not None:
-                        raise SchemaError(['invalid value for key %r' % key] +
-                                          x.autos, [e] + x.errors)
-
-            coverage = set(k for k in coverage if type(k) is not Optional)
-            required = set(k for k in s if type(k) is not Optional)
+        Field validators are shared with `compile` and between calls,
+        unless a `fields` dict of them is given.
+        """
+        return _compile_dict(dict((k, self._schema[k]) for k in keys), self._error,
+                             self._field_validators() if fields is None else fields)
 
-            for skey in required - coverage:
-                if isinstance(skey, Strategy):
-                    break
-                svalue = s[skey]
+    def _field_validators(self):
+        return self.__dict__.setdefault('_fields', {})
 
-                nkey = skey
-                try:
-                    nvalue = Schema(svalue, error=e).validate()
-                except SchemaError:
-                    break
+    def _compile(self):
+        if type(self._schema) is dict:
+            return _compile_dict(self._schema, self._error,
+                                 self._field_validators())
+        return _compile(self._schema, self._error)
 
-                new[nkey] = nvalue
-                coverage.add(skey)
 
-            if coverage != required:
-                raise SchemaError('missed keys %r' % (required - coverage), e)
-            if len(new) < len(data):
-                wrong_keys = set(data.keys()) - set(new.keys())
-                s_wrong_keys = ', '.join('%r' % k for k in sorted(wrong_keys))
-                raise SchemaError('wrong keys %s in %r' % (s_wrong_keys, data),
-                                  e)
-            return new
-
-        if isinstance(s, Strategy):
+class Optional(Schema):
+
+    """Marker for an optional part of Schema."""
+
+
+def _compile(s, e):
+    """Build the validator `Schema(s, error=e).validate` would apply."""
+    if type(s) in (list, tuple, set, frozenset):
+        return _compile_sequence(s, e)
+
+    if type(s) is dict:
+        return _compile_dict(s, e)
+
+    if isinstance(s, Strategy):
+        compiled = s.compile()
+
+        def validate(data):
             try:
-                return s.validate(data)
+                return compiled(data)
             except SchemaError as x:
-                raise SchemaError([None] + x.autos, [e] + x.errors)
+                raise x._chain(None, e)
             except BaseException as x:
-                raise SchemaError('%r.validate(%r) raised %r' % (s, data, x),
-                                  self._error)
+                raise SchemaError(('%r.validate(%r) raised %r', (s, data, x)), e, s, data)
+        return validate
 
-        if issubclass(type(s), type):
+    if issubclass(type(s), type):
+        def validate(data):
             if isinstance(data, s):
                 return data
-            else:
-                raise SchemaError('%r should be instance of %r' % (data, s), e)
+            raise SchemaError(('%r should be instance of %r', (data, s)), e, s, data)
+        return validate
 
-        if callable(s):
-            f = s.__name__
+    if callable(s):
+        def validate(data):
             try:
                 if s(data):
                     return data
             except SchemaError as x:
-                raise SchemaError([None] + x.autos, [e] + x.errors)
+                raise x._chain(None, e)
             except BaseException as x:
-                raise SchemaError('%s(%r) raised %r' % (f, data, x),
-                                  self._error)
-            raise SchemaError('%s(%r) should evaluate to True' % (f, data), e)
+                raise SchemaError(('%s(%r) raised %r', (s.__name__, data, x)), e, s, data)
+            raise SchemaError(('%s(%r) should evaluate to True', (s.__name__, data)), e, s, data)
+        return validate
 
+    def validate(data):
         if s == data:
             return data
+        raise SchemaError(('%r does not match %r', (s, data)), e, s, data)
+    return validate
 
-        else:
-            raise SchemaError('%r does not match %r' % (s, data), e)
 
+def _compile_sequence(s, e):
+    type_ = type(s)
+    validate_type = _compile(type_, e)
+    alternatives = Or(*s, error=e)
+    if len(s) == 1:
+        # skip the Or, its message is added when an element fails
+        validate_one = _compile(list(s)[0], e)
 
-class Optional(Schema):
+        def validate_item(data):
+            try:
+                return validate_one(data)
+            except SchemaError as x:
+                raise x._chain(('%r did not validate %r', (alternatives, data)), e)
+    else:
+        validate_item = alternatives.compile()
 
-    """Marker for an optional part of Schema."""
+    def validate_items(data):
+        result = []
+        append = result.append
+        for i, d in enumerate(data):
+            try:
+                append(validate_item(d))
+            except SchemaError as x:
+                x.path = (i,) + x.path
+                raise
+        return result if type_ is list else type_(result)
+
+    if s and all(issubclass(type(i), type) for i in s):
+        # instance checks return the elements unchanged
+        types = tuple(s)
+
+        def validate(data):
+            data = validate_type(data)
+            if all(isinstance(d, types) for d in data):
+                return type_(data)
+            return validate_items(data)
+        return validate
+
+    def validate(data):
+        return validate_items(validate_type(data))
+    return validate
+
+
+def _hashable(s):
+    try:
+        hash(s)
+    except TypeError:
+        return False
+    return True
+
+
+# returned by key matchers instead of raising a SchemaError
+_no_match = object()
+
+
+def _compile_matcher(s, e):
+    """Build a function returning the validated key or `_no_match`."""
+    while type(s) in (Schema, Optional) and s._error is None:
+        s = s._schema
+    if issubclass(type(s), type):
+        return lambda key: key if isinstance(key, s) else _no_match
+    if priority(s) == 1:
+        return lambda key: key if s == key else _no_match
+    validate = _compile(s, e)
+
+    def match(key):
+        try:
+            return validate(key)
+        except SchemaError:
+            return _no_match
+    return match
+
+
+def _compile_dict(s, e, fields=None):
+    fields = {} if fields is None else fields
+    validate_type = _compile(dict, e)
+    # Literal keys and Optional(literal) keys are dispatched with a hash
+    # lookup, every other key is matched in priority order. An optional
+    # literal only wins when none of the patterns sorted before it matches.
+    literals = {}
+    optionals = {}
+    patterns = []
+    for skey in sorted(s, key=priority):
+        if skey not in fields:
+            fields[skey] = _compile(s[skey], e)
+        entry = (skey, fields[skey], type(skey) is not Optional)
+        if priority(skey) == 1:
+            literals[skey] = entry
+        elif (type(skey) is Optional and priority(skey._schema) == 1
+              and _hashable(skey._schema)):
+            optionals.setdefault(skey._schema, (tuple(patterns), entry))
+        else:
+            patterns.append((skey, _compile_matcher(skey, e)) + entry[1:])
+    unmatched = (tuple(patterns), None)
+    required = set(k for k in s if type(k) is not Optional)
+    # required keys are filled from their schema's default when missing
+    defaults = dict((k, Schema(s[k], error=e)) for k in required)
+
+    def validate(data):
+        data = validate_type(data)
+        new = type(data)()  # new - is a dict of the validated values
+        coverage = set()  # non-optional schema keys that were matched
+        for key, value in data.iteritems():
+            entry = literals.get(key)
+            if entry is None:
+                before, entry = optionals.get(key, unmatched)
+                for skey, match_key, validate_value, is_required in before:
+                    matched = match_key(key)
+                    if matched is _no_match:
+                        continue
+                    key = matched
+                    entry = skey, validate_value, is_required
+                    break
+                else:
+                    if entry is None:
+                        continue
+            skey, validate_value, is_required = entry
+            try:
+                new[key] = validate_value(value)
+            except SchemaError as x:
+                x.path = (key,) + x.path
+                raise
+            if is_required:
+                coverage.add(skey)
+
+        if len(coverage) != len(required):
+            for skey in required - coverage:
+                if isinstance(skey, Strategy):
+                    break
+                try:
+                    nvalue = defaults[skey].validate()
+                except SchemaError:
+                    break
+                new[skey] = nvalue
+                coverage.add(skey)
+
+            if coverage != required:
+                raise SchemaError(('missed keys %r', (required - coverage,)), e, s, data)
+        if len(new) < len(data):
+            wrong_keys = set(data.keys()) - set(new.keys())
+            s_wrong_keys = ', '.join('%r' % k for k in sorted(wrong_keys))
+            raise SchemaError(('wrong keys %s in %r', (s_wrong_keys, data)), e, s, data)
+        return new
+    return validate
@@ -27,6 +27,6 @@ setup(
         'Programming Language :: Python :: 2.7',
     ],
     install_requires=[
-        'pymongo>=2.5',
+        'pymongo>=2.7',
     ],
 )
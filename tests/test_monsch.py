@@ -2,9 +2,15 @@
 
 import bson
 import datetime
+import io
 import re
 import unittest
-from monsch import Pools, Document, Default, Or, And, Optional, Use, SchemaError
+import monsch.monsch
+from monsch import Pools, Document, Schema, Default, Or, And, Optional, Use, SchemaError
+from monsch import HistogramCollector, set_collector
+from monsch.aio import AsyncDocument, AsyncPools
+from monsch.json_schema import to_json_schema
+from benchmarks.fake import FakeClient
 
 
 connection_name = 'test'
@@ -41,6 +47,47 @@ class TestDoc(Document):
     }
 
 
+class SchemaTestCase(unittest.TestCase):
+
+    def test_compile(self):
+        schema = Schema({'name': Use(str), Optional('tags'): [int]})
+        validate = schema.compile()
+        assert validate is schema.compile()
+        assert validate({'name': 1, 'tags': [2]}) == {'name': '1', 'tags': [2]}
+        with self.assertRaises(SchemaError) as compiled_error:
+            validate({'tags': ['a']})
+        with self.assertRaises(SchemaError) as error:
+            schema.validate({'tags': ['a']})
+        assert compiled_error.exception.code == error.exception.code
+
+    def test_dict_key_dispatch(self):
+        schema = Schema({'a': int, Optional('b'): int, basestring: str})
+        assert schema.validate({'a': 1, 'b': 'x', 'c': 'y'}) == {'a': 1, 'b': 'x', 'c': 'y'}
+        with self.assertRaises(SchemaError):
+            schema.validate({'a': 'x'})
+        with self.assertRaises(SchemaError):
+            schema.validate({'b': 1})
+
+    def test_error_details(self):
+        schema = Schema({'a': {'b': Or(int, None)}})
+        with self.assertRaises(SchemaError) as error:
+            schema.validate({'a': {'b': 'x'}})
+        assert error.exception.path == ('a', 'b')
+        assert error.exception.value == 'x'
+        assert str(error.exception) == error.exception.code
+        assert error.exception.args == (error.exception.code,)
+        assert repr(error.exception) == 'SchemaError(%r)' % error.exception.code
+        assert "Or(<type 'int'>, None) did not validate 'x'" in error.exception.autos
+
+    def test_list_items(self):
+        assert Schema([basestring]).validate(['a', u'b']) == ['a', u'b']
+        assert Schema([Use(int)]).validate(['1', 2]) == [1, 2]
+        with self.assertRaises(SchemaError) as error:
+            Schema({'ids': [int]}).validate({'ids': [1, 2, 'x']})
+        assert error.exception.path == ('ids', 2)
+        assert "Or(<type 'int'>) did not validate 'x'" in error.exception.autos
+
+
 class MonschTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -51,6 +98,32 @@ class MonschTestCase(unittest.TestCase):
         TestDoc.get_collection().drop()
         Pools.disconnect(connection_name)
 
+    def test_connection_registry(self):
+        connection = Pools.get_connection(connection_name)
+        assert Pools.get_connection(connection_name) is connection
+        assert Pools.get_connection() is connection
+
+        Pools._pid = -1  # as seen from a forked child
+        assert Pools.get_connection(connection_name) is not connection
+
+    def test_collection_cache(self):
+        collection = TestDoc.get_collection()
+        assert TestDoc.get_collection() is collection
+        Pools.disconnect(connection_name)
+        assert TestDoc.get_collection() is not collection
+
+        class OtherDoc(TestDoc):
+            __collection__ = 'other_collection'
+            __pool__ = 'other'
+            structure = {'name': str}
+
+        Pools.set_confs('other', dict(connection_confs, db='test_other'))
+        try:
+            assert OtherDoc.get_collection().database.name == 'test_other'
+            assert TestDoc.get_collection().database.name == 'test'
+        finally:
+            Pools.del_confs('other')
+
     def test_create_doc(self):
         doc = TestDoc({
             'name': 'test1',
@@ -96,6 +169,17 @@ class MonschTestCase(unittest.TestCase):
                 'confs': None,
             })
 
+    def test_validate_partial(self):
+        assert TestDoc.validate_partial({'price': '1.5'}) == {'price': 1.5}
+        assert frozenset(['price']) in TestDoc._partial_validators
+        with self.assertRaises(SchemaError):
+            TestDoc.validate_partial({'price': '1.5', 'unknown': 1})
+        assert frozenset(['price', 'unknown']) not in TestDoc._partial_validators
+        _id = bson.ObjectId()
+        assert TestDoc.validate_id(_id) == _id
+        with self.assertRaises(SchemaError):
+            TestDoc.validate_id('1')
+
     def test_save_doc(self):
         doc = TestDoc({
             'name': 'test1',
@@ -143,6 +227,459 @@ class MonschTestCase(unittest.TestCase):
         getdoc = TestDoc(doc['_id'])
         assert getdoc['ctime'] - ctime < datetime.timedelta(0, 0, 1000)
 
+    def test_find(self):
+        for i in range(3):
+            TestDoc({
+                'name': 'testfind%d' % i,
+                'price': i,
+                'version': 'v0.0.1',
+                'confs': {
+                    'type': 'a',
+                },
+            }).save()
+
+        docs = list(TestDoc.find({'price': {'$gte': 1}}, sort=[('price', 1)], batch_size=2))
+        assert [doc['name'] for doc in docs] == ['testfind1', 'testfind2']
+        assert all(doc._in_db and not doc._changed for doc in docs)
+
+        doc = TestDoc.find_one({'name': 'testfind0'}, projection=['name'])
+        assert doc['name'] == 'testfind0'
+        assert 'price' not in doc
+        assert TestDoc.find_one({'name': 'missing'}) is None
+        self.assertRaises(ValueError, TestDoc.find_one, {}, projection={'_id': 0})
+        self.assertRaises(ValueError, TestDoc.find, projection={'_id': False, 'name': True})
+
+    def test_get_many(self):
+        ids = []
+        for i in range(3):
+            doc = TestDoc({
+                'name': 'testgetmany%d' % i,
+                'price': i,
+                'version': 'v0.0.1',
+                'confs': {
+                    'type': 'a',
+                },
+            })
+            ids.append(doc.save())
+
+        missing = bson.ObjectId()
+        docs = TestDoc.get_many([ids[2], missing, ids[0]], chunk_size=1)
+        assert docs[1] is None
+        assert [docs[0]._id, docs[2]._id] == [ids[2], ids[0]]
+        docs = TestDoc.get_many([ids[2], missing, ids[0]], skip_missing=True)
+        assert [doc['name'] for doc in docs] == ['testgetmany2', 'testgetmany0']
+        with self.assertRaises(SchemaError):
+            TestDoc.get_many(['1'])
+
+    def test_bulk_save(self):
+        docs = [TestDoc({
+            'name': 'testbulk%d' % i,
+            'price': i,
+            'version': 'v0.0.1',
+            'desc': 'bulk',
+            'confs': {
+                'type': 'a',
+            },
+        }) for i in range(5)]
+        ids = TestDoc.bulk_save(docs, chunk_size=2)
+        assert all(ids)
+        assert all(doc._in_db and not doc._changed for doc in docs)
+        assert TestDoc.get_collection().find({'_id': {'$in': ids}}).count() == 5
+
+        docs[0]['price'] = 10
+        del docs[1]['desc']
+        TestDoc.bulk_save(docs, replace=False)
+        assert TestDoc(ids[0])['price'] == 10
+        assert 'desc' not in TestDoc(ids[1])
+
+    def test_nested_commit(self):
+        doc = TestDoc({
+            'name': 'testnested',
+            'price': 1,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        doc.save()
+
+        doc['confs.type'] = 'b'
+        doc.inc('counts.total', 2)
+        doc.inc('counts.total')
+        doc.push('groups', 'admin')
+        assert doc._changed_doc == {'confs.type': 'b'}
+        assert doc._ops == {'$inc': {'counts.total': 3},
+                            '$push': {'groups': {'$each': ['admin']}}}
+        with self.assertRaises(SchemaError):
+            doc['confs.type'] = 'd'
+        assert doc['confs.type'] == 'b'
+        doc.commit()
+
+        doc = TestDoc(doc._id)
+        assert doc['confs'] == {'type': 'b'}
+        assert doc['counts'] == {'total': 3}
+        assert doc['groups'] == ['user', 'admin']
+
+        doc['counts'] = {'total': 0}
+        doc.inc('counts.total')
+        doc.pull('groups', 'user')
+        assert doc._changed_doc == {'counts': {'total': 1}}
+        doc.commit()
+        doc = TestDoc(doc._id)
+        assert doc['counts.total'] == 1
+        assert doc['groups'] == ['admin']
+
+    def test_cache(self):
+        class CachedDoc(TestDoc):
+            __collection__ = collection_name
+            __options__ = {'cache': {'size': 1, 'ttl': 60}}
+            structure = TestDoc._schema._schema.copy()
+
+        doc = CachedDoc({
+            'name': 'testcache',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        doc.save()
+        first = CachedDoc(doc._id)
+        first['confs']['type'] = 'b'
+        second = CachedDoc(doc._id)
+        assert second['confs'] == {'type': 'a'}
+        assert CachedDoc.cache_stats()['hits'] == 1
+
+        second['price'] = 1
+        second.commit()
+        assert CachedDoc(doc._id)['price'] == 1
+
+        other = CachedDoc(dict(doc._doc, _id=bson.ObjectId()))
+        CachedDoc(other.save())
+        assert CachedDoc.cache_stats()['evictions'] == 1
+
+    def test_trusted_load(self):
+        _id = TestDoc.get_collection().insert({
+            'name': 'testtrusted',
+            'price': 1,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        doc = TestDoc(_id, trusted=True)
+        assert doc._doc['price'] == 1 and doc._unchecked
+        assert isinstance(doc['price'], float)
+        assert 'price' not in doc._unchecked
+        assert 'counts' not in doc
+
+        doc.verify()
+        assert doc._unchecked is None
+        assert doc['counts'] == {'total': 0}
+
+        doc = TestDoc.find_one({'_id': _id}, trusted=True)
+        doc._doc['confs'] = {'type': 'd'}
+        with self.assertRaises(SchemaError):
+            doc['confs']
+
+    def test_diff_save(self):
+        doc = TestDoc({
+            'name': 'testdiff',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        doc.save()
+        doc = TestDoc(doc._id)
+        collection = TestDoc.get_collection()
+        collection.update({'_id': doc._id}, {'$set': {'desc': 'concurrent'}})
+
+        doc['confs'] = {'type': 'b'}
+        assert doc._prepare_write(True) == {'$set': {'confs.type': 'b'}}
+        doc.save()
+        stored = collection.find_one({'_id': doc._id})
+        assert stored['confs'] == {'type': 'b'}
+        assert stored['desc'] == 'concurrent'
+
+        for key, value in (('name', 'x'), ('price', 1), ('version', 'v0.0.2'),
+                           ('status', 0), ('groups', ['x'])):
+            doc[key] = value
+        doc.save()
+        assert 'desc' not in collection.find_one({'_id': doc._id})
+
+        doc = TestDoc(doc._id)
+        assert doc._snapshot['confs'] is doc._doc['confs']
+        doc['counts']['total'] = 5
+        doc['desc'] = 'changed'
+        assert doc._prepare_write(True) == {'$set': {'counts': {'total': 5}, 'desc': 'changed'}}
+
+        class LooseDoc(Document):
+            __collection__ = collection_name
+            structure = {Optional('_id'): bson.ObjectId, 'flag': object, 'val': object,
+                         'sub': {'n': object}}
+
+        _id = LooseDoc({'flag': 1, 'val': 2, 'sub': {'n': 1}}).save()
+        doc = LooseDoc(_id)
+        doc['flag'] = True
+        doc['val'] = 2.0
+        doc['sub'] = {'n': 1.0}
+        doc.save()
+        stored = collection.find_one({'_id': _id})
+        assert type(stored['flag']) is bool and type(stored['val']) is float
+        assert type(stored['sub']['n']) is float
+
+    def test_partial_load(self):
+        doc = TestDoc({
+            'name': 'testpartial',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+            'desc': 'partial',
+        })
+        doc.save()
+        doc = TestDoc(doc._id, fields=('name', 'price'))
+        assert 'desc' not in doc._doc
+        assert doc['desc'] == 'partial'
+
+        doc['price'] = 5
+        doc.save()
+        stored = TestDoc.get_collection().find_one({'_id': doc._id})
+        assert stored['price'] == 5
+        assert stored['confs'] == {'type': 'a'}
+
+        doc = TestDoc(doc._id, fields=('name', 'price'))
+        del doc['desc']
+        doc.save()
+        assert 'desc' not in TestDoc.get_collection().find_one({'_id': doc._id})
+
+    def test_raw_load(self):
+        from bson.raw_bson import RawBSONDocument
+        _id = bson.ObjectId()
+        raw = RawBSONDocument(bson.BSON.encode({
+            '_id': _id,
+            'name': 'testraw',
+            'price': 0,
+            'version': 'v0.0.1',
+            'status': 0,
+            'groups': [],
+            'confs': {
+                'type': 'a',
+            },
+        }))
+        doc = TestDoc._from_db(raw)
+        assert doc._id == _id
+        assert doc['confs'] == {'type': 'a'}
+        assert type(doc['confs']) is dict
+
+        doc['price'] = 3
+        assert doc._raw is None
+        assert doc._prepare_write(False) == {'$set': {'price': 3}}
+
+    def test_write_behind(self):
+        class BufferedTestDoc(Document):
+            __collection__ = collection_name
+            __options__ = {'write_behind': {'max_delay': 60}}
+            structure = TestDoc.structure
+
+        doc = BufferedTestDoc({
+            'name': 'testbuffer',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        doc.save()
+        collection = BufferedTestDoc.get_collection()
+        for i in xrange(3):
+            doc.inc('counts.total')
+            doc.commit()
+        doc['desc'] = 'buffered'
+        doc.commit()
+        assert len(BufferedTestDoc._buffer) == 1
+        assert collection.find_one({'_id': doc._id})['counts'] == {'total': 0}
+
+        stored = BufferedTestDoc.get_many([doc._id])[0]
+        assert len(BufferedTestDoc._buffer) == 0
+        assert stored['counts'] == {'total': 3}
+        assert stored['desc'] == 'buffered'
+
+        doc['price'] = 1
+        doc.commit()
+        doc.remove()
+        assert len(BufferedTestDoc._buffer) == 0
+        BufferedTestDoc._buffer.close()
+
+    def test_paginate(self):
+        ids = TestDoc.bulk_save(TestDoc({
+            'name': 'testpage%d' % i,
+            'price': i,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        }) for i in xrange(5))
+
+        pages, token = [], None
+        while True:
+            docs, token = TestDoc.paginate(page_size=2, after=token)
+            pages.append([doc._id for doc in docs])
+            if token is None:
+                break
+        assert pages == [sorted(ids)[:2], sorted(ids)[2:4], sorted(ids)[4:]]
+        self.assertRaises(ValueError, TestDoc.paginate, sort_key=('name', 1))
+        self.assertRaises(ValueError, TestDoc.paginate, after='garbage')
+
+        class PagedTestDoc(Document):
+            __collection__ = collection_name
+            structure = TestDoc.structure
+            indices = [
+                {'fields': [('name', 1)]},
+                {'fields': [('price', -1), ('_id', -1)]},
+            ]
+
+        docs, token = PagedTestDoc.paginate(sort_key=('price', 1), page_size=3)
+        assert [doc['price'] for doc in docs] == [0, 1, 2]
+        docs, token = PagedTestDoc.paginate(sort_key=('price', 1), page_size=3, after=token)
+        assert [doc['price'] for doc in docs] == [3, 4] and token is None
+        self.assertRaises(ValueError, PagedTestDoc.paginate, sort_key=('name', 1))
+
+    def test_sync_indices(self):
+        class IndexedTestDoc(Document):
+            __collection__ = collection_name
+            structure = TestDoc.structure
+            indices = [
+                {'fields': [('name', 1)], 'unique': True},
+                {'fields': [('version', 1), ('status', -1)]},
+            ]
+
+        collection = IndexedTestDoc.get_collection()
+        collection.create_index([('price', 1)])
+        assert len(IndexedTestDoc.ensure_indices()) == 2
+        result = IndexedTestDoc.sync_indices(drop=True)
+        assert result == {'created': [], 'undeclared': ['price_1']}
+        assert 'price_1' not in collection.index_information()
+
+    def test_server_schema(self):
+        schema, covered, untranslated = TestDoc.server_schema()
+        assert covered == set(['_id', 'ctime', 'confs'])
+        assert schema['properties']['confs'] == {
+            'bsonType': 'object',
+            'properties': {'type': {'enum': ['a', 'b', 'c']}},
+            'required': ['type'],
+            'additionalProperties': False,
+        }
+        assert 'name' in [path for path, node in untranslated]
+
+        # 2 ** 40 is an int on python 2 but stored as a BSON int64
+        assert bson.BSON.encode({'n': 2 ** 40})[4] == '\x12'
+        schema, _, _ = to_json_schema({'n': int, 'ids': [int]})
+        assert 'long' in schema['properties']['n']['bsonType']
+        assert 'long' in schema['properties']['ids']['items']['bsonType']
+
+        class ServerTestDoc(Document):
+            __collection__ = collection_name
+            __options__ = {'server_validation': True}
+            structure = TestDoc.structure
+
+        doc = {
+            'name': 'testserver',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'z',
+            },
+        }
+        # as for a collection without the validator, every field is checked
+        ServerTestDoc._server_validated = False
+        self.assertRaises(SchemaError, ServerTestDoc, doc)
+        self.assertRaises(SchemaError, ServerTestDoc._validate_write, doc)
+
+        # as after apply_server_schema(), writes skip the fields it checks
+        ServerTestDoc._server_validated = True
+        assert 'ctime' in ServerTestDoc._validate_write(doc)
+        doc['price'] = 'x'
+        self.assertRaises(SchemaError, ServerTestDoc._validate_write, doc)
+
+    def test_instrument(self):
+        collector = HistogramCollector()
+        set_collector(collector)
+        try:
+            doc = TestDoc({
+                'name': 'testinstrument',
+                'price': 0,
+                'version': 'v0.0.1',
+                'confs': {
+                    'type': 'a',
+                },
+            })
+            doc.save()
+            doc.refresh()
+        finally:
+            set_collector(None)
+
+        stats = collector.stats()
+        assert stats[('validate', ('document', 'TestDoc'))]['count'] == 3
+        assert ('field', ('document', 'TestDoc'), ('field', 'price')) in stats
+        assert stats[('db', ('document', 'TestDoc'), ('op', 'save'))]['count'] == 1
+        # the collector was unregistered after Document._db_call checked it
+        assert monsch.instrument.db_call('TestDoc', 'find_one', max, (1, 2), {}) == 2
+        assert stats[('db.received', ('document', 'TestDoc'), ('op', 'find_one'))]['sum'] > 0
+
+    def test_validate_many(self):
+        docs = [{
+            'name': 'testmany%d' % i,
+            'price': i,
+            'version': 'v0.0.1' if i % 3 else 'bad',
+            'confs': {
+                'type': 'a',
+            },
+        } for i in xrange(10)]
+        for workers in (None, 2):
+            results = list(TestDoc.validate_many(docs, workers=workers, chunk_size=3))
+            assert [r['name'] for r in results if isinstance(r, dict)] == \
+                ['testmany%d' % i for i in xrange(10) if i % 3]
+            errors = [r for r in results if isinstance(r, SchemaError)]
+            assert len(errors) == 4
+            assert errors[0].path == ('version',)
+
+    def test_export_import(self):
+        ids = TestDoc.bulk_save(TestDoc({
+            'name': 'testexport%d' % i,
+            'price': i,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        }) for i in xrange(5))
+        for format in ('bson', 'ndjson'):
+            stream = io.BytesIO()
+            progress = []
+            assert TestDoc.export(stream, format=format, batch_size=2,
+                                  progress=progress.append) == 5
+            assert progress == [2, 4, 5]
+
+            TestDoc.get_collection().remove()
+            stream.seek(0)
+            assert TestDoc.import_(stream, format=format, batch_size=2) == 5
+            assert sorted(doc._id for doc in TestDoc.find()) == sorted(ids)
+
+        class CachedDoc(TestDoc):
+            __collection__ = collection_name
+            __options__ = {'cache': {'size': 10, 'ttl': 60}}
+            structure = TestDoc._schema._schema.copy()
+
+        doc = CachedDoc(ids[0])
+        stream = io.BytesIO()
+        stream.write(bson.BSON.encode(dict(doc._doc, price=7.0)))
+        stream.seek(0)
+        assert CachedDoc.import_(stream, trusted=True) == 1
+        assert CachedDoc(ids[0])['price'] == 7
+
     def test_remove(self):
         doc = TestDoc({
             'name': 'testremove',
@@ -162,5 +699,64 @@ class MonschTestCase(unittest.TestCase):
         assert not TestDoc.get_collection().find_one({'_id': _id})
 
 
+class AsyncTestCase(unittest.TestCase):
+    # backed by the in-memory client of the benchmarks
+
+    def setUp(self):
+        Pools.set_confs('async', connection_confs)
+        self.client, monsch.monsch.MongoClient = monsch.monsch.MongoClient, FakeClient
+
+    def tearDown(self):
+        monsch.monsch.MongoClient = self.client
+        AsyncPools.shutdown('async')
+        Pools.del_confs('async')
+
+    def test_async(self):
+        class AsyncTestDoc(AsyncDocument):
+            __collection__ = collection_name
+            __pool__ = 'async'
+            structure = TestDoc.structure
+
+        class BufferedAsyncTestDoc(AsyncDocument):
+            __collection__ = collection_name
+            __pool__ = 'async'
+            __options__ = {'write_behind': {'max_delay': 60}}
+            structure = TestDoc.structure
+
+        doc = AsyncTestDoc({
+            'name': 'testasync',
+            'price': 0,
+            'version': 'v0.0.1',
+            'confs': {
+                'type': 'a',
+            },
+        })
+        _id = doc.save().result()
+        doc = AsyncTestDoc(_id)
+        assert not doc._in_db
+        assert doc.load().result() is doc
+        assert doc['name'] == 'testasync'
+
+        doc['price'] = 2
+        doc.commit().result()
+        assert AsyncTestDoc.find_one({'_id': _id}).result()['price'] == 2
+        assert len(AsyncTestDoc.find().result()) == 1
+
+        buffered = BufferedAsyncTestDoc(_id)
+        buffered.load().result()
+        buffered.inc('price')
+        buffered.commit().result()
+        assert AsyncTestDoc.find_one({'_id': _id}).result()['price'] == 2
+        assert buffered.refresh().result()['price'] == 3
+
+        stream = io.BytesIO()
+        assert AsyncTestDoc.export(stream).result() == 1
+        stream.seek(0)
+        assert AsyncTestDoc.import_(stream).result() == 1
+
+        doc.remove().result()
+        assert AsyncTestDoc.get_many([_id]).result() == [None]
+
+
 if __name__ == '__main__':
     unittest.main()